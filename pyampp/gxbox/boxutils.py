@@ -1,13 +1,29 @@
+import math
+import functools
 import numpy as np
 import astropy.units as u
-from astropy.coordinates import SkyCoord
-from sunpy.coordinates import HeliographicCarrington, HeliographicStonyhurst
-from sunpy.map import all_coordinates_from_map, Map
+from astropy.coordinates import SkyCoord, CartesianRepresentation
+from astropy.wcs import WCS
+from sunpy.coordinates import HeliographicCarrington, HeliographicStonyhurst, Heliocentric
+from sunpy.map import Map
 from PyQt5.QtWidgets import  QMessageBox
-
-import numpy as np
+from PyQt5.QtGui import QDoubleValidator, QIntValidator
+from PyQt5.QtCore import QLocale
+from numba import njit, prange, types
+import h5py
 from astropy.io import fits
 
+@njit('void(f4[:, ::1], i4[:, ::1], i8)', parallel=True, nogil=True, cache=True)
+def _disambig_kernel(azimuth, disambig, method):
+    """
+    Adds 180 degrees in place to the C-contiguous float32 ``azimuth`` wherever bit ``method`` of the int32
+    ``disambig`` is set, and wraps the result into [0, 360).
+    """
+    af, df = azimuth.ravel(), disambig.ravel()
+    for i in prange(af.size):
+        af[i] = (af[i] + 180.0 * ((df[i] >> method) & 1)) % 360.0
+
+
 def hmi_disambig(azimuth_map, disambig_map, method=2):
     """
     Combine HMI disambiguation result with azimuth.
@@ -22,84 +38,548 @@ def hmi_disambig(azimuth_map, disambig_map, method=2):
     :return: map_azimuth: sunpy.map.Map, The azimuth map with disambiguation applied.
     :rtype: sunpy.map.Map
     """
-    # Load data from FITS files
-    azimuth = azimuth_map.data
+    # Load data from FITS files; work on a native-endian float32 copy so the input map is left untouched
+    azimuth = np.array(azimuth_map.data, dtype=np.float32, order='C')
     disambig = disambig_map.data
 
     # Check dimensions of the arrays
     if azimuth.shape != disambig.shape:
         raise ValueError("Dimension of two images do not agree")
 
-    # Fix disambig to ensure it is integer
-    disambig = disambig.astype(int)
+    # Fix disambig to ensure it is a native-endian, C-contiguous integer array
+    disambig = np.ascontiguousarray(disambig, dtype=np.int32)
 
     # Validate method index
     if method < 0 or method > 2:
         method = 2
         print("Invalid disambiguation method, set to default method = 2")
 
-    # Apply disambiguation method
-    disambig_corr = disambig // (2 ** method)  # Move the corresponding bit to the lowest
-    index = disambig_corr % 2 != 0  # True where bits indicate flip
-
-    # Update azimuth where flipping is needed
-    azimuth[index] += 180
-    azimuth = azimuth % 360  # Ensure azimuth stays within [0, 360]
+    # Apply disambiguation method: flip by 180 where the method's bit is set and keep azimuth within [0, 360),
+    # in a single pass
+    _disambig_kernel(azimuth, disambig, method)
 
     map_azimuth = Map(azimuth, azimuth_map.meta)
     return map_azimuth
 
 
+# Explicit signatures compile eagerly at import (or load from the on-disk cache), so the first call from the GUI
+# does not stall the event loop on a JIT compile.
+@njit('void(f4[::1], f4[::1], f4[::1])', parallel=True, nogil=True, fastmath=True, cache=True)
+def _sincos(x, s, c):
+    """
+    Sine and cosine of ``x`` (in radians) in a single pass, written in place into ``s`` and ``c``.
+
+    ``x``, ``s`` and ``c`` must be C-contiguous arrays of the same shape.
+    """
+    xf, sf, cf = x.ravel(), s.ravel(), c.ravel()
+    for i in prange(xf.size):
+        sf[i] = math.sin(xf[i])
+        cf[i] = math.cos(xf[i])
+
+
+# Read-only 1D inputs, so the cached (read-only) geometry arrays can be passed straight in
+_ro_intp_1d = types.Array(types.intp, 1, 'C', readonly=True)
+_ro_f4_1d = types.Array(types.float32, 1, 'C', readonly=True)
+
+
+@njit(types.void(_ro_intp_1d, _ro_f4_1d, _ro_f4_1d, _ro_f4_1d, _ro_f4_1d, _ro_f4_1d, _ro_f4_1d, _ro_f4_1d,
+                 types.float32, types.float32, types.float32, types.float32,
+                 types.float32[:, ::1], types.float32[:, ::1], types.float32[:, ::1]),
+      parallel=True, nogil=True, fastmath=True, cache=True)
+def _b2ptr_kernel(index, field, gamma, psi, sinphi, cosphi, sinlam, coslam, sinb, cosb, sinp, cosp, bp, bt, br):
+    """
+    Fused per-pixel conversion of the HMI vector field to the spherical (Bp, Bt, Br) components.
+
+    Operates on the 1D arrays of on-disk pixels. The result for pixel ``i`` is written in place at the flat
+    position ``index[i]`` of the C-contiguous output planes ``bp``, ``bt`` and ``br``.
+    """
+    bpf, btf, brf = bp.ravel(), bt.ravel(), br.ravel()
+    sbsp, sbcp = sinb * sinp, sinb * cosp
+    cbsp, cbcp = cosb * sinp, cosb * cosp
+    for i in prange(field.size):
+        sg = math.sin(gamma[i])
+        cg = math.cos(gamma[i])
+        sp_ = math.sin(psi[i])
+        cp_ = math.cos(psi[i])
+
+        b_xi = -field[i] * sg * sp_
+        b_eta = field[i] * sg * cp_
+        b_zeta = field[i] * cg
+
+        sphi, cphi = sinphi[i], cosphi[i]
+        slam, clam = sinlam[i], coslam[i]
+
+        # Subexpressions shared between the rows of the transformation matrix
+        t1 = sbsp * cphi + cosp * sphi
+        t2 = sbcp * cphi - sinp * sphi
+        t3 = cosb * cphi
+
+        k11 = clam * t1 - slam * cbsp
+        k12 = - clam * t2 + slam * cbcp
+        k13 = clam * t3 + slam * sinb
+        k21 = slam * t1 + clam * cbsp
+        k22 = - slam * t2 - clam * cbcp
+        k23 = slam * t3 - clam * sinb
+        k31 = - sbsp * sphi + cosp * cphi
+        k32 = sbcp * sphi + sinp * cphi
+        k33 = - cosb * sphi
+
+        k = index[i]
+        bpf[k] = k31 * b_xi + k32 * b_eta + k33 * b_zeta
+        btf[k] = k21 * b_xi + k22 * b_eta + k23 * b_zeta
+        brf[k] = k11 * b_xi + k12 * b_eta + k13 * b_zeta
+
+
+@njit('void(f8[::1], f8[::1], f8, f8, f8, f8, f4[::1], f4[::1])',
+      parallel=True, nogil=True, fastmath=False, cache=True)
+def _hpc_to_hgs_kernel(tx, ty, dsun, rsun, b0, l0, lon, lat):
+    """
+    Closed-form helioprojective (Tx, Ty, in degrees) to Heliographic Stonyhurst (lon, lat, in radians) conversion
+    of points on the solar surface, for an observer at distance ``dsun`` and Stonyhurst latitude/longitude ``b0``/``l0``
+    (in radians). Lines of sight that miss the sphere of radius ``rsun`` give NaN.
+    """
+    d2r = math.pi / 180.0
+    sinb0, cosb0 = math.sin(b0), math.cos(b0)
+    for i in prange(tx.size):
+        ctx, stx = math.cos(tx[i] * d2r), math.sin(tx[i] * d2r)
+        cty, sty = math.cos(ty[i] * d2r), math.sin(ty[i] * d2r)
+        # Distance from the observer to the first intersection of the line of sight with the sphere
+        cos_alpha = cty * ctx
+        q = dsun * cos_alpha
+        disc = q * q - dsun * dsun + rsun * rsun
+        if disc < 0:
+            lon[i] = np.nan
+            lat[i] = np.nan
+            continue
+        dist = q - math.sqrt(disc)
+        # Heliocentric Cartesian, then rotate by the observer's B0 and L0
+        x = dist * cty * stx
+        y = dist * sty
+        z = dsun - dist * cos_alpha
+        r = math.sqrt(x * x + y * y + z * z)
+        lat[i] = math.asin((y * cosb0 + z * sinb0) / r)
+        lon[i] = l0 + math.atan2(x, z * cosb0 - y * sinb0)
+
+
+@functools.lru_cache(maxsize=1)
+def _b2ptr_geometry(wcs_header, ny, nx, dsun, rsun, b0, l0):
+    """
+    On-disk pixel indices and the sine/cosine of their Stonyhurst longitude and latitude for a given map geometry.
+
+    The result depends only on the WCS and the observer, so it is cached and shared between calls; the returned
+    arrays are read-only. A full-disk entry holds several hundred MB, so only the latest geometry is kept and GxBox
+    clears it when its window closes.
+
+    :param wcs_header: str, The map WCS as a FITS header string.
+    :param ny: int, Number of rows of the map.
+    :param nx: int, Number of columns of the map.
+    :param dsun: float, Observer distance from Sun center, in meters.
+    :param rsun: float, Solar radius, in meters.
+    :param b0: float, Observer Stonyhurst latitude, in radians.
+    :param l0: float, Observer Stonyhurst longitude, in radians.
+
+    :return: index, sinphi, cosphi, sinlam, coslam
+    :rtype: tuple of numpy.ndarray
+    """
+    wcs = WCS(fits.Header.fromstring(wcs_header))
+    yy, xx = np.indices((ny, nx), dtype=np.float64)
+    tx, ty = wcs.wcs_pix2world(xx.ravel(), yy.ravel(), 0)
+    # Wrap the helioprojective longitude to [-180, 180) as sunpy does
+    tx = (tx + 180.0) % 360.0 - 180.0
+    phi = np.empty(ny * nx, dtype=np.float32)
+    lambda_ = np.empty(ny * nx, dtype=np.float32)
+    _hpc_to_hgs_kernel(np.ascontiguousarray(tx), np.ascontiguousarray(ty), dsun, rsun, b0, l0, phi, lambda_)
+
+    # Off-limb pixels have no heliographic coordinates; only the on-disk ones are converted.
+    index = np.flatnonzero(np.isfinite(phi) & np.isfinite(lambda_))
+    phi, lambda_ = phi[index], lambda_[index]
+
+    sinphi, cosphi = np.empty_like(phi), np.empty_like(phi)
+    sinlam, coslam = np.empty_like(lambda_), np.empty_like(lambda_)
+    _sincos(phi, sinphi, cosphi)
+    _sincos(lambda_, sinlam, coslam)
+
+    for arr in (index, sinphi, cosphi, sinlam, coslam):
+        arr.flags.writeable = False
+    return index, sinphi, cosphi, sinlam, coslam
+
+
 def hmi_b2ptr(map_field, map_inclination, map_azimuth):
     sz = map_field.data.shape
     ny, nx = sz
 
-    field = map_field.data
-    gamma = np.deg2rad(map_inclination.data)
-    psi = np.deg2rad(map_azimuth.data)
-
-    b_xi = -field * np.sin(gamma) * np.sin(psi)
-    b_eta = field * np.sin(gamma) * np.cos(psi)
-    b_zeta = field * np.cos(gamma)
-
-    foo = all_coordinates_from_map(map_field).transform_to(HeliographicStonyhurst)
-    phi = foo.lon
-    lambda_ = foo.lat
+    # Equivalent to all_coordinates_from_map(map_field).transform_to(HeliographicStonyhurst), without building
+    # the per-pixel SkyCoord
+    observer = map_field.observer_coordinate.transform_to(HeliographicStonyhurst(obstime=map_field.date))
+    index, sinphi, cosphi, sinlam, coslam = _b2ptr_geometry(
+        map_field.wcs.to_header_string(), ny, nx, float(observer.radius.to_value(u.m)),
+        float(map_field.rsun_meters.to_value(u.m)), float(observer.lat.to_value(u.rad)),
+        float(observer.lon.to_value(u.rad)))
 
-    b = np.deg2rad(map_field.fits_header["crlt_obs"])
-    p = np.deg2rad(-map_field.fits_header["crota2"])
+    # HMI segments are single precision; keep the whole computation in float32 to halve the memory traffic.
+    # The gathers below are fresh C-contiguous copies, so the degree-to-radian conversion can run in place.
+    field = map_field.data.ravel()[index].astype(np.float32, copy=False)
+    gamma = map_inclination.data.ravel()[index].astype(np.float32, copy=False)
+    psi = map_azimuth.data.ravel()[index].astype(np.float32, copy=False)
+    np.deg2rad(gamma, out=gamma)
+    np.deg2rad(psi, out=psi)
 
-    phi, lambda_ = np.deg2rad(phi), np.deg2rad(lambda_)
+    # Read the keywords straight from the metadata; fits_header rebuilds a full FITS header on every access
+    meta = map_field.meta
+    b = np.float32(np.deg2rad(meta["crlt_obs"]))
+    p = np.float32(np.deg2rad(-meta["crota2"]))
 
     sinb, cosb = np.sin(b), np.cos(b)
     sinp, cosp = np.sin(p), np.cos(p)
-    sinphi, cosphi = np.sin(phi), np.cos(phi)  # nx*ny
-    sinlam, coslam = np.sin(lambda_), np.cos(lambda_)  # nx*ny
-
-    k11 = coslam * (sinb * sinp * cosphi + cosp * sinphi) - sinlam * cosb * sinp
-    k12 = - coslam * (sinb * cosp * cosphi - sinp * sinphi) + sinlam * cosb * cosp
-    k13 = coslam * cosb * cosphi + sinlam * sinb
-    k21 = sinlam * (sinb * sinp * cosphi + cosp * sinphi) + coslam * cosb * sinp
-    k22 = - sinlam * (sinb * cosp * cosphi - sinp * sinphi) - coslam * cosb * cosp
-    k23 = sinlam * cosb * cosphi - coslam * sinb
-    k31 = - sinb * sinp * sinphi + cosp * cosphi
-    k32 = sinb * cosp * sinphi + sinp * cosphi
-    k33 = - cosb * sinphi
-
-    bptr = np.zeros((3, ny, nx))
-
-    bptr[0, :, :] = k31 * b_xi + k32 * b_eta + k33 * b_zeta
-    bptr[1, :, :] = k21 * b_xi + k22 * b_eta + k23 * b_zeta
-    bptr[2, :, :] = k11 * b_xi + k12 * b_eta + k13 * b_zeta
-
-    header = map_field.fits_header
-    map_bp = Map(bptr[0, :, :], header)
-    map_bt = Map(bptr[1, :, :], header)
-    map_br = Map(bptr[2, :, :], header)
+
+    bp = np.full((ny, nx), np.nan, dtype=np.float32)
+    bt = np.full((ny, nx), np.nan, dtype=np.float32)
+    br = np.full((ny, nx), np.nan, dtype=np.float32)
+    _b2ptr_kernel(index, field, gamma, psi, sinphi, cosphi, sinlam, coslam, sinb, cosb, sinp, cosp, bp, bt, br)
+
+    map_bp = Map(bp, meta)
+    map_bt = Map(bt, meta)
+    map_br = Map(br, meta)
 
     return map_bp, map_bt, map_br
 
 
+@njit('void(f8[::1], f8[::1], f8[::1], f8[:, ::1], f8[::1], f8, f8[::1], f8[::1], f8[::1])',
+      parallel=True, nogil=True, fastmath=False, cache=True)
+def _hcc_to_hpc_kernel(x, y, z, rot, shift, dsun, tx, ty, dist):
+    """
+    Moves Heliocentric Cartesian points into the heliocentric frame of the observer with ``rot`` and ``shift`` and
+    converts them to helioprojective (Tx, Ty, in radians) and observer distance (Thompson 2006, eq. 16), for an
+    observer at distance ``dsun`` in the unit of the points.
+    """
+    for i in prange(x.size):
+        xo = rot[0, 0] * x[i] + rot[0, 1] * y[i] + rot[0, 2] * z[i] + shift[0]
+        yo = rot[1, 0] * x[i] + rot[1, 1] * y[i] + rot[1, 2] * z[i] + shift[1]
+        zo = dsun - (rot[2, 0] * x[i] + rot[2, 1] * y[i] + rot[2, 2] * z[i] + shift[2])
+        d = math.sqrt(xo * xo + yo * yo + zo * zo)
+        tx[i] = math.atan2(xo, zo)
+        ty[i] = math.asin(yo / d)
+        dist[i] = d
+
+
+def hcc_to_hpc_rotation(frame_hcc, frame_obs):
+    """
+    Resolves the transformation that `hcc_to_hpc` applies between two frames.
+
+    The result only depends on the frames, so callers converting many point sets between the same pair of frames can
+    compute it once and pass it to `hcc_to_hpc`.
+
+    :param frame_hcc: `~sunpy.coordinates.Heliocentric`, The frame of the input points.
+    :param frame_obs: `~sunpy.coordinates.Helioprojective`, The target frame.
+
+    :return: The rotation matrix from ``frame_hcc`` to the heliocentric frame of the observer of ``frame_obs``, the
+        shift of the Sun's center between the two frames, and the Sun-observer distance.
+    :rtype: tuple of numpy.ndarray, u.Quantity and u.Quantity
+    """
+    observer = frame_obs.observer.transform_to(HeliographicStonyhurst(obstime=frame_obs.obstime))
+    # Both frames are heliocentric, so the transformation is a rotation plus, when their obstimes differ, the motion
+    # of the Sun's center between them. Both are read off the images of the origin and of three basis vectors, long
+    # enough for the transform's rounding to stay negligible.
+    scale = 1e9
+    xyz = np.hstack([np.zeros((3, 1)), scale * np.eye(3)]) << u.m
+    moved = SkyCoord(CartesianRepresentation(xyz), frame=frame_hcc)
+    moved = moved.transform_to(Heliocentric(observer=observer, obstime=frame_obs.obstime)).cartesian.xyz.to_value(u.m)
+    shift = moved[:, 0]
+    rot = np.ascontiguousarray((moved[:, 1:] - shift[:, None]) / scale, dtype=np.float64)
+    return rot, shift << u.m, observer.radius
+
+
+def hcc_to_hpc(x, y, z, frame_hcc, frame_obs, rotation=None):
+    """
+    Converts Heliocentric Cartesian points to the helioprojective frame of an observer.
+
+    Equivalent to ``SkyCoord(x=x, y=y, z=z, frame=frame_hcc).transform_to(frame_obs)`` for large point sets: the
+    frame machinery only resolves the transformation between the two heliocentric frames, and the per-point work
+    runs in a compiled kernel.
+
+    :param x: u.Quantity, Heliocentric x coordinates, of any shape.
+    :param y: u.Quantity, Heliocentric y coordinates, same shape as x.
+    :param z: u.Quantity, Heliocentric z coordinates, same shape as x.
+    :param frame_hcc: `~sunpy.coordinates.Heliocentric`, The frame of the input points.
+    :param frame_obs: `~sunpy.coordinates.Helioprojective`, The target frame.
+    :param rotation: tuple, optional, The result of `hcc_to_hpc_rotation` for the same frames; resolved from the
+        frames when not given.
+
+    :return: The points in the target frame.
+    :rtype: `~astropy.coordinates.SkyCoord`
+    """
+    unit = x.unit
+    rot, shift, observer_radius = hcc_to_hpc_rotation(frame_hcc, frame_obs) if rotation is None else rotation
+
+    shape = np.shape(x)
+    xs, ys, zs = (np.ascontiguousarray(np.ravel(c.to_value(unit)), dtype=np.float64) for c in (x, y, z))
+    tx, ty, dist = np.empty_like(xs), np.empty_like(xs), np.empty_like(xs)
+    _hcc_to_hpc_kernel(xs, ys, zs, rot, np.ascontiguousarray(shift.to_value(unit), dtype=np.float64),
+                       float(observer_radius.to_value(unit)), tx, ty, dist)
+    return SkyCoord(Tx=(tx << u.rad).reshape(shape), Ty=(ty << u.rad).reshape(shape),
+                    distance=(dist << unit).reshape(shape), frame=frame_obs)
+
+
+@njit(parallel=True, nogil=True, fastmath=True, cache=True)
+def _fieldline_segments_kernel(x, y, bx, by, bz, point_offsets, segment_offsets, segments, magnitude):
+    """
+    Packs the segments between consecutive points of each line into ``segments`` and the field strength at the
+    first point of each segment into ``magnitude``; one line per iteration.
+    """
+    for k in prange(point_offsets.size - 1):
+        p0 = point_offsets[k]
+        s0 = segment_offsets[k]
+        for i in range(segment_offsets[k + 1] - s0):
+            p = p0 + i
+            segments[s0 + i, 0, 0] = x[p]
+            segments[s0 + i, 0, 1] = y[p]
+            segments[s0 + i, 1, 0] = x[p + 1]
+            segments[s0 + i, 1, 1] = y[p + 1]
+            magnitude[s0 + i] = math.sqrt(bx[p] * bx[p] + by[p] * by[p] + bz[p] * bz[p])
+
+
+def fieldline_segments(x, y, bx, by, bz, lengths):
+    """
+    Builds line segments and their field strengths from the concatenated points of several lines.
+
+    Segments only join consecutive points of the same line; each carries the field strength at its first point.
+
+    :param x: numpy.ndarray, x coordinates of all points, line after line.
+    :param y: numpy.ndarray, y coordinates of all points.
+    :param bx: numpy.ndarray, Field x component at all points.
+    :param by: numpy.ndarray, Field y component at all points.
+    :param bz: numpy.ndarray, Field z component at all points.
+    :param lengths: array-like of int, Number of points of each line.
+
+    :return: segments, magnitude: arrays of shape (M, 2, 2) and (M,), with M the total number of segments.
+    :rtype: tuple of numpy.ndarray
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    point_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    segment_offsets = np.concatenate([[0], np.cumsum(np.maximum(lengths - 1, 0))])
+    segments = np.empty((segment_offsets[-1], 2, 2), dtype=np.float64)
+    magnitude = np.empty(segment_offsets[-1], dtype=np.float64)
+    x, y, bx, by, bz = (np.ascontiguousarray(a, dtype=np.float64) for a in (x, y, bx, by, bz))
+    _fieldline_segments_kernel(x, y, bx, by, bz, point_offsets, segment_offsets, segments, magnitude)
+    return segments, magnitude
+
+
+@njit(nogil=True, cache=True)
+def _field_at(bx, by, bz, x, y, z, origin, spacing):
+    """
+    Trilinearly interpolates the (nz, ny, nx) field cubes of a uniform grid at (x, y, z); NaN outside the grid.
+    """
+    nz, ny, nx = bx.shape
+    fx = (x - origin[0]) / spacing[0]
+    fy = (y - origin[1]) / spacing[1]
+    fz = (z - origin[2]) / spacing[2]
+    if not (0. <= fx <= nx - 1 and 0. <= fy <= ny - 1 and 0. <= fz <= nz - 1):
+        return np.nan, np.nan, np.nan
+    i = min(int(fx), nx - 2)
+    j = min(int(fy), ny - 2)
+    k = min(int(fz), nz - 2)
+    tx = fx - i
+    ty = fy - j
+    tz = fz - k
+    vx = vy = vz = 0.
+    for dk in range(2):
+        wz = tz if dk else 1. - tz
+        for dj in range(2):
+            wyz = (ty if dj else 1. - ty) * wz
+            for di in range(2):
+                w = (tx if di else 1. - tx) * wyz
+                vx += w * bx[k + dk, j + dj, i + di]
+                vy += w * by[k + dk, j + dj, i + di]
+                vz += w * bz[k + dk, j + dj, i + di]
+    return vx, vy, vz
+
+
+@njit(nogil=True, cache=True)
+def _direction_at(bx, by, bz, x, y, z, origin, spacing, sign):
+    """
+    Unit vector along (``sign`` = 1) or against (``sign`` = -1) the field at (x, y, z); NaN outside the grid or
+    where the field vanishes.
+    """
+    vx, vy, vz = _field_at(bx, by, bz, x, y, z, origin, spacing)
+    b = math.sqrt(vx * vx + vy * vy + vz * vz)
+    if not b > 1e-12:
+        return np.nan, np.nan, np.nan
+    return sign * vx / b, sign * vy / b, sign * vz / b
+
+
+@njit(nogil=True, cache=True)
+def _rk4_step(bx, by, bz, x, y, z, h, origin, spacing, sign):
+    """
+    Advances (x, y, z) by an arc length ``h`` along the field line with one classical Runge-Kutta step; NaN once
+    any stage leaves the grid or hits a null.
+    """
+    k1x, k1y, k1z = _direction_at(bx, by, bz, x, y, z, origin, spacing, sign)
+    k2x, k2y, k2z = _direction_at(bx, by, bz, x + .5 * h * k1x, y + .5 * h * k1y, z + .5 * h * k1z, origin, spacing,
+                                  sign)
+    k3x, k3y, k3z = _direction_at(bx, by, bz, x + .5 * h * k2x, y + .5 * h * k2y, z + .5 * h * k2z, origin, spacing,
+                                  sign)
+    k4x, k4y, k4z = _direction_at(bx, by, bz, x + h * k3x, y + h * k3y, z + h * k3z, origin, spacing, sign)
+    return (x + h / 6. * (k1x + 2. * k2x + 2. * k3x + k4x),
+            y + h / 6. * (k1y + 2. * k2y + 2. * k3y + k4y),
+            z + h / 6. * (k1z + 2. * k2z + 2. * k3z + k4z))
+
+
+@njit(nogil=True, cache=True)
+def _trace_direction(bx, by, bz, seed, h, max_steps, origin, spacing, sign, points, start, step_index):
+    """
+    Integrates from ``seed`` in one direction for at most ``max_steps`` steps, stopping at the grid boundary or a
+    null, and returns the number of steps taken. When ``points`` is not empty, step ``n`` is stored at row
+    ``start + step_index * n`` of it.
+    """
+    x, y, z = seed[0], seed[1], seed[2]
+    n = 0
+    while n < max_steps:
+        x, y, z = _rk4_step(bx, by, bz, x, y, z, h, origin, spacing, sign)
+        if math.isnan(x) or math.isnan(_field_at(bx, by, bz, x, y, z, origin, spacing)[0]):
+            break
+        n += 1
+        if points.shape[0]:
+            row = start + step_index * n
+            points[row, 0] = x
+            points[row, 1] = y
+            points[row, 2] = z
+    return n
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def _trace_streamlines_kernel(bx, by, bz, origin, spacing, seeds, h, max_steps, offsets, n_back, n_forward,
+                              points, field):
+    """
+    Traces one seed per iteration. With empty ``points`` only the number of backward and forward steps of each
+    line is counted into ``n_back`` and ``n_forward`` (-1 backward for a seed outside the grid or on a null);
+    otherwise each non-empty line is written at ``offsets``, backward steps reversed, then the seed, then the
+    forward steps, with the field at every point in ``field``.
+    """
+    for s in prange(seeds.shape[0]):
+        seed = seeds[s]
+        if points.shape[0] == 0:
+            if math.isnan(_direction_at(bx, by, bz, seed[0], seed[1], seed[2], origin, spacing, 1.)[0]):
+                n_back[s] = -1
+                n_forward[s] = 0
+            else:
+                n_back[s] = _trace_direction(bx, by, bz, seed, h, max_steps, origin, spacing, -1., points, 0, 0)
+                n_forward[s] = _trace_direction(bx, by, bz, seed, h, max_steps, origin, spacing, 1., points, 0, 0)
+            continue
+        p0 = offsets[s]
+        if offsets[s + 1] == p0:
+            continue
+        mid = p0 + n_back[s]
+        points[mid, 0] = seed[0]
+        points[mid, 1] = seed[1]
+        points[mid, 2] = seed[2]
+        _trace_direction(bx, by, bz, seed, h, n_back[s], origin, spacing, -1., points, mid, -1)
+        _trace_direction(bx, by, bz, seed, h, n_forward[s], origin, spacing, 1., points, mid, 1)
+        for p in range(p0, offsets[s + 1]):
+            field[p, 0], field[p, 1], field[p, 2] = _field_at(bx, by, bz, points[p, 0], points[p, 1], points[p, 2],
+                                                              origin, spacing)
+
+
+def trace_streamlines(bx, by, bz, origin, spacing, seeds, step, max_steps=2000, max_length=np.inf):
+    """
+    Traces field lines of a vector field sampled on a uniform grid, in both directions from each seed.
+
+    The lines are integrated along the unit field direction with fixed-step fourth-order Runge-Kutta and trilinear
+    interpolation, in parallel over the seeds, and stop at the grid boundary, at a field null, or after
+    ``max_steps`` steps or ``max_length`` arc length in each direction.
+
+    :param bx: numpy.ndarray, Field x component, shape (nz, ny, nx) (x varying fastest, as the points of a VTK image).
+    :param by: numpy.ndarray, Field y component, same shape as bx.
+    :param bz: numpy.ndarray, Field z component, same shape as bx.
+    :param origin: tuple of float, Position of the first grid point (x, y, z).
+    :param spacing: tuple of float, Grid spacing along x, y and z.
+    :param seeds: numpy.ndarray, (n, 3) starting points.
+    :param step: float, Integration step, in the length unit of the grid.
+    :param max_steps: int, Maximum number of steps in each direction.
+    :param max_length: float, Maximum arc length of the line in each direction.
+
+    :return: points, field, lengths: the (N, 3) points of all lines one after the other, the (N, 3) field at those
+        points, and the number of points of each line; seeds outside the grid or on a null give no line.
+    :rtype: tuple of numpy.ndarray
+    """
+    bx, by, bz = (np.ascontiguousarray(b) for b in (bx, by, bz))
+    origin = np.asarray(origin, dtype=np.float64)
+    spacing = np.asarray(spacing, dtype=np.float64)
+    seeds = np.ascontiguousarray(seeds, dtype=np.float64).reshape(-1, 3)
+    max_steps = int(min(max_steps, max_length / step))
+    n_back = np.empty(len(seeds), dtype=np.int64)
+    n_forward = np.empty(len(seeds), dtype=np.int64)
+    no_points = np.empty((0, 3), dtype=np.float64)
+    # Count the steps of every line first, then trace again into exactly sized outputs
+    _trace_streamlines_kernel(bx, by, bz, origin, spacing, seeds, step, max_steps, np.zeros(1, dtype=np.int64),
+                              n_back, n_forward, no_points, no_points)
+    lengths = n_back + n_forward + 1
+    keep = lengths > 1
+    lengths[~keep] = 0
+    n_back[~keep] = 0
+    n_forward[~keep] = 0
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    points = np.empty((offsets[-1], 3), dtype=np.float64)
+    field = np.empty((offsets[-1], 3), dtype=np.float64)
+    _trace_streamlines_kernel(bx, by, bz, origin, spacing, seeds, step, max_steps,
+                              offsets, n_back, n_forward, points, field)
+    return points, field, lengths[keep]
+
+
+def write_b3d_h5(filename, b3d, dtype=np.float32):
+    """
+    Writes the 3D magnetic field cubes to an HDF5 file.
+
+    Each model type (e.g. 'lfff', 'nlfff') is stored as a group holding one chunked, shuffled and
+    LZF-compressed dataset per field component. Scalar and other non-array entries are stored as attributes
+    of the group.
+
+    :param filename: str, Path to the output HDF5 file.
+    :type filename: str
+    :param b3d: dict, Mapping of model type to a dict of field components (e.g. {'nlfff': {'bx': ..., 'by': ..., 'bz': ...}}).
+        Model types set to None are skipped.
+    :type b3d: dict
+    :param dtype: numpy.dtype, optional, Storage dtype of the floating-point field components. Default is float32;
+        pass None to keep the dtype of the input arrays. Non-floating arrays are always stored as they are.
+    :type dtype: numpy.dtype, optional
+    """
+    with h5py.File(filename, 'w') as f:
+        for b3dtype, components in b3d.items():
+            if components is None:
+                continue
+            group = f.create_group(b3dtype)
+            for component, data in components.items():
+                if not isinstance(data, np.ndarray) or data.ndim == 0:
+                    group.attrs[component] = data
+                    continue
+                # Only floating components are converted; integer masks and indices keep their dtype
+                if dtype is not None and np.issubdtype(data.dtype, np.floating):
+                    data = data.astype(dtype, copy=False)
+                group.create_dataset(component, data=data, chunks=True, compression='lzf', shuffle=True)
+
+
+def read_b3d_h5(filename):
+    """
+    Reads the 3D magnetic field cubes written by :func:`write_b3d_h5`.
+
+    :param filename: str, Path to the HDF5 file.
+    :type filename: str
+
+    :return: b3d: dict, Mapping of model type to a dict of field components.
+    :rtype: dict
+    """
+    b3d = {}
+    # Enlarge the chunk cache so whole cubes decompress without evicting chunks
+    with h5py.File(filename, 'r', rdcc_nbytes=64 * 1024 * 1024, rdcc_nslots=10007) as f:
+        for b3dtype, group in f.items():
+            b3d[b3dtype] = dict(group.attrs)
+            for component, ds in group.items():
+                # Read straight into a preallocated cube, without an intermediate full-size temporary
+                out = np.empty(ds.shape, dtype=ds.dtype)
+                ds.read_direct(out)
+                b3d[b3dtype][component] = out
+    return b3d
+
+
 def validate_number(func):
     """
     Decorator to validate if the input in the widget is a number.
@@ -132,3 +612,36 @@ def set_QLineEdit_text_pos(line_edit, text):
     """
     line_edit.setText(text)
     line_edit.setCursorPosition(0)
+
+
+def set_double_validator(line_edit, bottom=-float('inf'), top=float('inf')):
+    """
+    Restricts the QLineEdit to floating point numbers in [bottom, top].
+
+    Qt then only emits returnPressed for acceptable input, so the handlers never see invalid numbers.
+
+    :param line_edit: QLineEdit
+        The QLineEdit widget.
+    :param bottom: float
+        The lowest accepted value.
+    :param top: float
+        The highest accepted value.
+    """
+    validator = QDoubleValidator(bottom, top, 1000, line_edit)
+    # Always accept '.' as the decimal separator, matching float() in the handlers
+    validator.setLocale(QLocale.c())
+    line_edit.setValidator(validator)
+
+
+def set_int_validator(line_edit, bottom, top):
+    """
+    Restricts the QLineEdit to integers in [bottom, top].
+
+    :param line_edit: QLineEdit
+        The QLineEdit widget.
+    :param bottom: int
+        The lowest accepted value.
+    :param top: int
+        The highest accepted value.
+    """
+    line_edit.setValidator(QIntValidator(bottom, top, line_edit))
@@ -1,21 +1,33 @@
 import sys
 import os
+import functools
+import pickle
+from time import monotonic
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QLabel, QLineEdit, QPushButton, QComboBox,
                              QRadioButton,
                              QCheckBox, QGridLayout, QGroupBox, QVBoxLayout, QHBoxLayout, QDateTimeEdit,
                              QCalendarWidget, QTextEdit, QMessageBox,
-                             QFileDialog)
+                             QFileDialog, QProgressBar)
 from PyQt5.QtGui import QIcon, QFont
-from PyQt5.QtCore import QSize, QDateTime, Qt
+from PyQt5.QtCore import QSize, QDateTime, Qt, QObject, QRunnable, QThreadPool, QTimer, QProcess, pyqtSignal
 from pyampp.util.config import *
 import pyampp
 from pathlib import Path
 import argparse
-from pyampp.gxbox.boxutils import validate_number
+import numba
+
+# The GUI forks a QProcess for the GXbox command, and with numba's TBB threading layer loaded (importing boxutils
+# compiles its parallel kernels) the process then hangs on exit. Prefer the other layers unless the user has chosen
+# an order; this must run before boxutils is imported.
+if 'NUMBA_THREADING_LAYER_PRIORITY' not in os.environ:
+    numba.config.THREADING_LAYER_PRIORITY = ['omp', 'workqueue', 'tbb']
+
+from pyampp.gxbox.boxutils import set_double_validator, set_int_validator
 from astropy.coordinates import SkyCoord
 import astropy.units as u
 from astropy.time import Time
-from sunpy.coordinates import get_earth, HeliographicStonyhurst, HeliographicCarrington, Helioprojective
+from sunpy.coordinates import get_earth, HeliographicStonyhurst, HeliographicCarrington, Helioprojective, \
+    RotatedSunFrame
 import numpy as np
 
 
@@ -23,6 +35,118 @@ base_dir = Path(pyampp.__file__).parent
 svg_dir = base_dir / 'gxbox' / 'UI'
 
 
+@functools.lru_cache(maxsize=64)
+def _path_exists(path, ttl_bucket):
+    return os.path.exists(path)
+
+
+def path_exists(path, ttl=10.):
+    """
+    Cached ``os.path.exists``, so repeated checks of e.g. a slow network mount do not stall the UI.
+
+    :param path: str
+        The path to check.
+    :param ttl: float
+        How long, in seconds, a result may be reused.
+    :return: bool
+        Whether the path exists.
+    """
+    return _path_exists(path, int(monotonic() // ttl))
+
+
+# Solar radius used for the model center coordinates, built once rather than on every call
+_RSUN_MODEL = 696 * u.Mm
+
+
+@functools.lru_cache(maxsize=128)
+def _earth_at(mjd_sec):
+    """
+    Cached Earth observer location.
+
+    :param mjd_sec: int
+        Observation time as MJD in whole seconds (MJD * 86400, rounded).
+    :return: SkyCoord
+        The Earth location at that time.
+    """
+    return get_earth(Time(mjd_sec / 86400., format='mjd'))
+
+
+def get_earth_cached(time):
+    """
+    Returns the Earth location at `time`, reusing previous lookups for the same second.
+
+    :param time: Time
+        The observation time.
+    :return: SkyCoord
+        The Earth location.
+    """
+    return _earth_at(int(round(time.mjd * 86400)))
+
+
+@functools.lru_cache(maxsize=128)
+def _make_center(mjd_sec, frame_name, x, y):
+    """
+    Cached construction of the model center coordinate.
+
+    :param mjd_sec: int
+        Observation time as MJD in whole seconds.
+    :param frame_name: str
+        One of 'helioprojective', 'heliographic_carrington' or 'heliographic_stonyhurst'.
+    :param x: float
+        Tx in arcsec, or longitude in deg.
+    :param y: float
+        Ty in arcsec, or latitude in deg.
+    :return: SkyCoord
+        The model center.
+    """
+    frame = _make_frame(mjd_sec, frame_name)
+    if frame_name == 'helioprojective':
+        return SkyCoord(x * u.arcsec, y * u.arcsec, frame=frame)
+    return SkyCoord(lon=x * u.deg, lat=y * u.deg, radius=_RSUN_MODEL, frame=frame)
+
+
+@functools.lru_cache(maxsize=128)
+def _display_frame(mjd_sec, frame_name):
+    """
+    Cached frame the model center is shown in by the coordinate radio buttons.
+
+    :param mjd_sec: int
+        Observation time as MJD in whole seconds.
+    :param frame_name: str
+        One of 'helioprojective', 'heliographic_carrington' or 'heliographic_stonyhurst'.
+    :return: BaseCoordinateFrame
+        The frame at that time; Helioprojective and Carrington frames are observed from Earth.
+    """
+    time = Time(mjd_sec / 86400., format='mjd')
+    time.format = 'isot'
+    if frame_name == 'helioprojective':
+        return Helioprojective(obstime=time, observer=_earth_at(mjd_sec))
+    if frame_name == 'heliographic_carrington':
+        return HeliographicCarrington(obstime=time, observer=_earth_at(mjd_sec))
+    return HeliographicStonyhurst(obstime=time)
+
+
+@functools.lru_cache(maxsize=128)
+def _make_frame(mjd_sec, frame_name):
+    """
+    Cached construction of the frame the model center is defined in.
+
+    :param mjd_sec: int
+        Observation time as MJD in whole seconds.
+    :param frame_name: str
+        One of 'helioprojective', 'heliographic_carrington' or 'heliographic_stonyhurst'.
+    :return: BaseCoordinateFrame
+        The frame at that time; the Helioprojective frame is observed from Earth.
+    """
+    time = Time(mjd_sec / 86400., format='mjd')
+    time.format = 'isot'
+    if frame_name == 'helioprojective':
+        return Helioprojective(obstime=time, observer=_earth_at(mjd_sec), rsun=_RSUN_MODEL)
+    if frame_name == 'heliographic_carrington':
+        return HeliographicCarrington(obstime=time)
+    return HeliographicStonyhurst(obstime=time)
+
+
 class CustomQLineEdit(QLineEdit):
     def setTextL(self, text):
         """
@@ -35,6 +159,54 @@ class CustomQLineEdit(QLineEdit):
         self.setCursorPosition(0)
 
 
+def read_box_metadata(boxfile):
+    """
+    Reads the model time, grid size, resolution and center of an external box.
+
+    :param boxfile: str
+        Path to the external box file.
+    :return: dict
+        The keys are 'model_time_orig', 'nx', 'ny', 'nz', 'box_res' and 'center'.
+    """
+    with open(boxfile, 'rb') as f:
+        boxdata = pickle.load(f)
+    map_bottom = boxdata['map_bottom']
+    model_time_orig = map_bottom.date
+    nx, ny, nz = boxdata['b3d']['nlfff']['bx'].shape
+    box_res = map_bottom.rsun_meters.to(u.Mm) * ((map_bottom.scale[0] * 1. * u.pix).to(u.rad) / u.rad)
+    center = map_bottom.center.transform_to(HeliographicStonyhurst(obstime=model_time_orig))
+    return dict(model_time_orig=model_time_orig, nx=nx, ny=ny, nz=nz, box_res=box_res, center=center)
+
+
+class BoxLoaderSignals(QObject):
+    """
+    Signals emitted by :class:`BoxLoader`.
+    """
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class BoxLoader(QRunnable):
+    """
+    Reads the metadata of an external box on a worker thread.
+
+    The result of :func:`read_box_metadata` is delivered to the UI thread through ``signals.loaded``.
+    """
+
+    def __init__(self, boxfile):
+        super().__init__()
+        self.boxfile = boxfile
+        self.signals = BoxLoaderSignals()
+
+    def run(self):
+        try:
+            boxmeta = read_box_metadata(self.boxfile)
+        except Exception as e:
+            self.signals.failed.emit(f"Failed to read {self.boxfile}: {e}")
+        else:
+            self.signals.loaded.emit(boxmeta)
+
+
 class PyAmppGUI(QMainWindow):
     """
     Main application GUI for the Solar Data Model.
@@ -106,6 +278,15 @@ class PyAmppGUI(QMainWindow):
         self.rotate_revert_button = None
         self.coords_center = None
         self.coords_center_orig = None
+        self._proc = None
+        self._loaded_box_key = None
+        # Coalesce bursts of time edits and command refreshes into single updates
+        self._time_debounce = QTimer(self, singleShot=True, interval=300)
+        self._time_debounce.timeout.connect(self._do_time_changed)
+        self._pending_cmd_widgets = set()
+        self._last_cmd_str = None
+        self._cmd_debounce = QTimer(self, singleShot=True, interval=50)
+        self._cmd_debounce.timeout.connect(self._flush_command_display)
         self.initUI()
 
     def initUI(self):
@@ -126,6 +307,13 @@ class PyAmppGUI(QMainWindow):
         self.add_status_log()
         self.update_coords_center()
 
+        # Busy indicator shown while an external box is being read
+        self.box_load_progress = QProgressBar()
+        self.box_load_progress.setRange(0, 0)
+        self.box_load_progress.setMaximumWidth(150)
+        self.box_load_progress.hide()
+        self.statusBar().addPermanentWidget(self.box_load_progress)
+
         # Set window properties
         self.setWindowTitle('Solar Data Model GUI')
         self.setGeometry(100, 100, 800, 600)  # Modify as needed
@@ -181,7 +369,7 @@ class PyAmppGUI(QMainWindow):
         """
         new_path = self.sdo_data_edit.text()
         self.update_dir(new_path, DOWNLOAD_DIR)
-        self.update_command_display()
+        self.update_command_display(self.sdo_data_edit)
 
     def update_gxmodel_dir(self):
         """
@@ -189,37 +377,67 @@ class PyAmppGUI(QMainWindow):
         """
         new_path = self.gx_model_edit.text()
         self.update_dir(new_path, GXMODEL_DIR)
-        self.update_command_display()
+        self.update_command_display(self.gx_model_edit)
 
     def read_external_box(self):
         """
         Reads the external box path based on the user input.
-        """
-        import pickle
 
+        The box is read on a worker thread; the UI is updated in :meth:`_on_box_loaded`.
+        """
         boxfile = self.external_box_edit.text()
-        with open(boxfile, 'rb') as f:
-            boxdata = pickle.load(f)
-            map_bottom = boxdata['map_bottom']
-            self.model_time_orig = map_bottom.date
-            nx, ny, nz = boxdata['b3d']['nlfff']['bx'].shape
-            box_res = map_bottom.rsun_meters.to(u.Mm) * ((map_bottom.scale[0] * 1. * u.pix).to(u.rad) / u.rad)
-            center = map_bottom.center.transform_to(
-                HeliographicStonyhurst(obstime=self.model_time_orig))
-        print("----------------------before model time set")
+        # Skip the reload when the same, unmodified file is already loaded
+        try:
+            box_key = (os.path.abspath(boxfile), os.path.getmtime(boxfile))
+        except OSError as e:
+            self.status_log_edit.append(f"Cannot read the external box {boxfile}: {e}")
+            self._loaded_box_key = None
+            return
+        if box_key == self._loaded_box_key:
+            return
+        self._loaded_box_key = box_key
+        self._box_loader = BoxLoader(boxfile)
+        self._box_loader.signals.loaded.connect(self._on_box_loaded)
+        self._box_loader.signals.failed.connect(self._on_box_load_failed)
+        self.box_load_progress.show()
+        self.statusBar().showMessage(f"Loading {boxfile} ...")
+        QThreadPool.globalInstance().start(self._box_loader)
+
+    def _on_box_loaded(self, boxmeta):
+        """
+        Updates the model configuration from the metadata of the loaded external box.
+
+        :param boxmeta: dict
+            The metadata returned by :func:`read_box_metadata`.
+        """
+        self.box_load_progress.hide()
+        self.statusBar().clearMessage()
+        self.model_time_orig = boxmeta['model_time_orig']
+        center = boxmeta['center']
         self.model_time_edit.setDateTime(QDateTime(self.model_time_orig.to_datetime()))
-        print("----------------------after model time set")
         self.hgs_radio_button.setChecked(True)
         self.coord_x_edit.setTextL(f'{center.lon.to(u.deg).value}')
         self.coord_y_edit.setTextL(f'{center.lat.to(u.deg).value}')
-        self.grid_x_edit.setTextL(f'{nx}')
-        self.grid_y_edit.setTextL(f'{ny}')
-        self.grid_z_edit.setTextL(f'{nz}')
-        self.res_edit.setTextL(f'{box_res.to(u.km).value}')
+        self.grid_x_edit.setTextL(f'{boxmeta["nx"]}')
+        self.grid_y_edit.setTextL(f'{boxmeta["ny"]}')
+        self.grid_z_edit.setTextL(f'{boxmeta["nz"]}')
+        self.res_edit.setTextL(f'{boxmeta["box_res"].to(u.km).value}')
         self.update_coords_center()
         self.coords_center_orig = self.coords_center
         self.update_command_display()
 
+    def _on_box_load_failed(self, message):
+        """
+        Reports a failed external box load.
+
+        :param message: str
+            The error message.
+        """
+        self.box_load_progress.hide()
+        self.statusBar().clearMessage()
+        self.status_log_edit.append(message)
+        self._loaded_box_key = None
+
     def update_external_box_dir(self):
         """
         Updates the external box directory path based on the user input.
@@ -228,7 +446,7 @@ class PyAmppGUI(QMainWindow):
         self.update_dir(new_path, os.getcwd())
         if os.path.isfile(self.external_box_edit.text()):
             self.read_external_box()
-        self.update_command_display()
+        self.update_command_display(self.external_box_edit)
 
     def update_dir(self, new_path, default_path):
         """
@@ -241,10 +459,9 @@ class PyAmppGUI(QMainWindow):
         """
         if new_path != default_path:
             # Normalize the path whether it's absolute or relative
-            if not os.path.isabs(new_path):
-                new_path = os.path.abspath(new_path)
+            new_path = os.path.abspath(new_path)
 
-            if not os.path.exists(new_path):  # Checks if the path does not exist
+            if not path_exists(new_path):  # Checks if the path does not exist
                 # Ask user if they want to create the directory
                 reply = QMessageBox.question(self, 'Create Directory?',
                                              "The directory does not exist. Do you want to create it?",
@@ -253,6 +470,7 @@ class PyAmppGUI(QMainWindow):
                 if reply == QMessageBox.Yes:
                     try:
                         os.makedirs(new_path)
+                        _path_exists.cache_clear()
                         # QMessageBox.information(self, "Directory Created", "The directory was successfully created.")
                     except PermissionError:
                         QMessageBox.critical(self, "Permission Denied",
@@ -269,8 +487,6 @@ class PyAmppGUI(QMainWindow):
         """
         Opens a file dialog for selecting the SDO data directory.
         """
-        options = QFileDialog.Options()
-        options |= QFileDialog.DontUseNativeDialog
         file_name = QFileDialog.getExistingDirectory(self, "Select Directory", DOWNLOAD_DIR)
         if file_name:
             self.sdo_data_edit.setText(file_name)
@@ -279,8 +495,6 @@ class PyAmppGUI(QMainWindow):
         """
         Opens a file dialog for selecting the GX model directory.
         """
-        options = QFileDialog.Options()
-        options |= QFileDialog.DontUseNativeDialog
         file_name = QFileDialog.getExistingDirectory(self, "Select Directory", GXMODEL_DIR)
         if file_name:
             self.gx_model_edit.setText(file_name)
@@ -289,8 +503,6 @@ class PyAmppGUI(QMainWindow):
         """
         Opens a file dialog for selecting the external box directory.
         """
-        options = QFileDialog.Options()
-        options |= QFileDialog.DontUseNativeDialog
         file_name, _ = QFileDialog.getOpenFileName(self, "Select File", os.getcwd(), "gxbox Files (*.gxbox)")
         # file_name = QFileDialog.getExistingDirectory(self, "Select Directory", os.getcwd())
         if file_name:
@@ -325,6 +537,9 @@ class PyAmppGUI(QMainWindow):
         self.model_time_edit.setCalendarWidget(QCalendarWidget())
         self.model_time_edit.setToolTip("Model time in UT")
         self.model_time_edit.dateTimeChanged.connect(self.on_time_input_changed)
+        # Rotate the model only once an edit is committed, not on every spinner step
+        self.model_time_edit.editingFinished.connect(self.on_time_input_committed)
+        self.model_time_edit.calendarWidget().clicked.connect(self.on_time_input_committed)
         self.model_time_layout.addWidget(self.model_time_edit)
         self.model_time_layout.addStretch()  # Add stretch
         main_layout.addLayout(self.model_time_layout)
@@ -338,12 +553,14 @@ class PyAmppGUI(QMainWindow):
         self.coord_x_edit = CustomQLineEdit("0.0")
         # self.coord_x_edit.setAlignment(Qt.AlignTrailing)
         self.coord_x_edit.setToolTip("Solar X coordinate of the model center in arcsec")
+        set_double_validator(self.coord_x_edit)
         self.coord_x_edit.returnPressed.connect(lambda: self.on_coord_x_input_return_pressed(self.coord_x_edit))
         coords_layout.addWidget(self.coord_x_edit)
         self.coord_y_label = QLabel("Y:")
         coords_layout.addWidget(self.coord_y_label)
         self.coord_y_edit = CustomQLineEdit("0.0")
         self.coord_y_edit.setToolTip("Solar Y coordinate of the model center in arcsec")
+        set_double_validator(self.coord_y_edit)
         self.coord_y_edit.returnPressed.connect(lambda: self.on_coord_y_input_return_pressed(self.coord_y_edit))
         self.coord_x_label.setFixedWidth(30)
         self.coord_y_label.setFixedWidth(30)
@@ -375,6 +592,7 @@ class PyAmppGUI(QMainWindow):
         grid_layout.addWidget(QLabel("X:"))
         self.grid_x_edit = CustomQLineEdit("64")
         self.grid_x_edit.setToolTip("Number of grid points in the x-direction")
+        set_int_validator(self.grid_x_edit, 1, 10000)
         self.grid_x_edit.returnPressed.connect(lambda: self.on_grid_x_input_return_pressed(self.grid_x_edit))
         self.grid_x_edit.setFixedWidth(100)
         self.grid_x_edit.setCursorPosition(0)
@@ -382,6 +600,7 @@ class PyAmppGUI(QMainWindow):
         grid_layout.addWidget(QLabel("Y:"))
         self.grid_y_edit = CustomQLineEdit("64")
         self.grid_y_edit.setToolTip("Number of grid points in the y-direction")
+        set_int_validator(self.grid_y_edit, 1, 10000)
         self.grid_y_edit.returnPressed.connect(lambda: self.on_grid_y_input_return_pressed(self.grid_y_edit))
         self.grid_y_edit.setFixedWidth(100)
         self.grid_y_edit.setCursorPosition(0)
@@ -389,6 +608,7 @@ class PyAmppGUI(QMainWindow):
         grid_layout.addWidget(QLabel("Z:"))
         self.grid_z_edit = CustomQLineEdit("64")
         self.grid_z_edit.setToolTip("Number of grid points in the z-direction")
+        set_int_validator(self.grid_z_edit, 1, 10000)
         self.grid_z_edit.returnPressed.connect(lambda: self.on_grid_z_input_return_pressed(self.grid_z_edit))
         self.grid_z_edit.setFixedWidth(100)
         self.grid_z_edit.setCursorPosition(0)
@@ -403,6 +623,7 @@ class PyAmppGUI(QMainWindow):
         self.res_edit.setFixedWidth(100)
         self.res_edit.setToolTip("Resolution in km")
         self.res_edit.setCursorPosition(0)
+        set_double_validator(self.res_edit, 0.0, 1e6)
         self.res_edit.returnPressed.connect(lambda: self.on_res_input_return_pressed(self.res_edit))
         res_padding_layout.addWidget(self.res_edit)
         res_padding_layout.addWidget(QLabel("Padding (%):"))
@@ -411,6 +632,7 @@ class PyAmppGUI(QMainWindow):
         self.padding_size_edit.setCursorPosition(0)
         self.padding_size_edit.setToolTip(
             "Padding as a percentage of box dimensions, increases each side of the box for extended margins.")
+        set_double_validator(self.padding_size_edit, 0.0, 1e6)
         self.padding_size_edit.returnPressed.connect(
             lambda: self.on_padding_size_input_return_pressed(self.padding_size_edit))
         self.padding_size_edit.setText("25")
@@ -459,6 +681,7 @@ class PyAmppGUI(QMainWindow):
         # Command Line Equivalent Display
         self.cmd_display_edit = QTextEdit()
         self.cmd_display_edit.setReadOnly(True)
+        self.cmd_display_edit.setAcceptRichText(False)  # The command is plain text
         self.cmd_display_edit.setMaximumHeight(75)  # Adjusted smaller height for the command display area
 
         # Setting a monospace font and appropriate size
@@ -481,6 +704,12 @@ class PyAmppGUI(QMainWindow):
         self.execute_button.setFixedWidth(50)
         cmd_button_layout.addWidget(self.execute_button)
 
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_command)
+        self.cancel_button.setToolTip("Stop the running GXbox process")
+        self.cancel_button.setEnabled(False)
+        cmd_button_layout.addWidget(self.cancel_button)
+
         self.save_button = QPushButton("Save")
         self.save_button.setText("")
         self.save_button.setIcon(QIcon(str(svg_dir / 'save.svg')))
@@ -517,27 +746,21 @@ class PyAmppGUI(QMainWindow):
         self.status_log_edit.setMinimumHeight(200)  # Adjusted smaller height for the command display area
         self.main_layout.addWidget(self.status_log_edit)
 
-    @validate_number
     def on_coord_x_input_return_pressed(self, widget):
         self.update_command_display(widget)
 
-    @validate_number
     def on_coord_y_input_return_pressed(self, widget):
         self.update_command_display(widget)
 
-    @validate_number
     def on_grid_x_input_return_pressed(self, widget):
         self.update_command_display(widget)
 
-    @validate_number
     def on_grid_y_input_return_pressed(self, widget):
         self.update_command_display(widget)
 
-    @validate_number
     def on_grid_z_input_return_pressed(self, widget):
         self.update_command_display(widget)
 
-    @validate_number
     def on_res_input_return_pressed(self, widget):
         self.update_command_display(widget)
 
@@ -560,11 +783,24 @@ class PyAmppGUI(QMainWindow):
         if count > 0 and layout.itemAt(count - 1).spacerItem():
             layout.takeAt(count - 1)
     def on_time_input_changed(self):
+        """
+        Refreshes the command display while the model time is being edited.
+
+        The model rotation is deferred until the edit is committed, see :meth:`on_time_input_committed`.
+        """
+        self.update_command_display(self.model_time_edit)
+
+    def on_time_input_committed(self):
+        """
+        Schedules the handling of a committed model time change, restarting the 300 ms debounce window.
+        """
+        self._time_debounce.start()
+
+    def _do_time_changed(self):
         if self.model_time_orig is not None:
             time = Time(self.model_time_edit.dateTime().toPyDateTime()).mjd
             model_time_orig = self.model_time_orig.mjd
             time_sec_diff = (time - model_time_orig) * 24 * 3600
-            print(time_sec_diff)
             if np.abs(time_sec_diff) >= 0.5:
                 self.on_rotate_model_to_time()
                 if self.rotate_revert_button is None:
@@ -588,6 +824,7 @@ class PyAmppGUI(QMainWindow):
 
     def on_rotate_revert_button_clicked(self):
         self.model_time_edit.setDateTime(QDateTime(self.model_time_orig.to_datetime()))
+        self.on_time_input_committed()
         self.rotate_revert()
 
     def rotate_revert(self):
@@ -602,13 +839,15 @@ class PyAmppGUI(QMainWindow):
         """
         Rotates the model to the specified time.
         """
-        from sunpy.coordinates import RotatedSunFrame
         point = self.coords_center_orig
         time = Time(self.model_time_edit.dateTime().toPyDateTime()).mjd
         model_time_orig = self.model_time_orig.mjd
         time_sec_diff = (time - model_time_orig) * 24 * 3600
         diffrot_point = SkyCoord(RotatedSunFrame(base=point, duration=time_sec_diff * u.s))
-        self.coords_center = diffrot_point.transform_to(self._coords_center.frame)
+        # Transform once, straight into the (cached) frame of the selected coordinate system; the update_*_state
+        # calls below then reuse the result instead of transforming again.
+        target_frame = _make_frame(int(round(time * 86400)), self._checked_frame_name())
+        self.coords_center = diffrot_point.transform_to(target_frame)
         print(self.coords_center_orig,self.coords_center)
         # self.status_log_edit.append("Model rotated to the specified time")
         if self.hpc_radio_button.isChecked():
@@ -623,19 +862,55 @@ class PyAmppGUI(QMainWindow):
     def update_command_display(self, widget=None):
         """
         Updates the command display with the current command.
+
+        Only the command fragment that depends on `widget` is rebuilt; all fragments are rebuilt when `widget` is None.
+        The refresh is coalesced: bursts of edits within 50 ms produce a single re-render.
+
+        :param widget: The widget whose value changed, optional.
+        :type widget: QWidget
         """
-        # print(widget)
-        # if widget:
-        #     if isinstance(widget, QDateTimeEdit):
-        #         current_value = widget.dateTime().toString("yyyy-MM-dd HH:mm:ss")
-        #     else:
-        #         current_value = widget.text()
-        #     self.previous_params[widget] = self.current_params.get(widget, current_value)
-        #     self.current_params[widget] = current_value
+        self._pending_cmd_widgets.add(widget)
+        self._cmd_debounce.start()
 
-        command = self.get_command()
-        self.cmd_display_edit.clear()
-        self.cmd_display_edit.append(" ".join(command))
+    def _flush_command_display(self):
+        """
+        Rebuilds the command fragments touched since the last refresh and re-renders the command display.
+        """
+        widgets, self._pending_cmd_widgets = self._pending_cmd_widgets, set()
+        parts = {self._cmd_part_of_widget(widget) if widget is not None else None for widget in widgets}
+        if None in parts or not hasattr(self, '_cmd_parts'):
+            self._cmd_parts = {name: self._build_cmd_part(name) for name in self._cmd_part_names}
+        else:
+            for part in parts:
+                self._cmd_parts[part] = self._build_cmd_part(part)
+        self._render_cmd()
+
+    _cmd_part_names = ('base', 'time', 'coords', 'box_dims', 'box_res', 'pad_frac', 'data_dir', 'gxmodel_dir',
+                       'external_box')
+
+    def _cmd_part_of_widget(self, widget):
+        """
+        Returns the name of the command fragment that depends on `widget`, or None if unknown.
+        """
+        return {self.model_time_edit: 'time',
+                self.coord_x_edit: 'coords', self.coord_y_edit: 'coords',
+                self.hpc_radio_button: 'coords', self.hgc_radio_button: 'coords', self.hgs_radio_button: 'coords',
+                self.grid_x_edit: 'box_dims', self.grid_y_edit: 'box_dims', self.grid_z_edit: 'box_dims',
+                self.res_edit: 'box_res',
+                self.padding_size_edit: 'pad_frac',
+                self.sdo_data_edit: 'data_dir',
+                self.gx_model_edit: 'gxmodel_dir',
+                self.external_box_edit: 'external_box'}.get(widget)
+
+    def _render_cmd(self):
+        """
+        Joins the cached command fragments into the command display.
+        """
+        cmd_str = " ".join(" ".join(self._cmd_parts[name]) for name in self._cmd_part_names if self._cmd_parts[name])
+        if cmd_str == self._last_cmd_str:
+            return
+        self._last_cmd_str = cmd_str
+        self.cmd_display_edit.setPlainText(cmd_str)
 
     def update_hpc_state(self, checked, coords_center=None):
         """
@@ -651,12 +926,11 @@ class PyAmppGUI(QMainWindow):
             self.coord_x_label.setText("X:")
             self.coord_y_label.setText("Y:")
             if coords_center is None:
-                obstime = Time(self.model_time_edit.dateTime().toPyDateTime())
-                observer = get_earth(obstime)
-                coords_center = self.coords_center.transform_to(Helioprojective(obstime=obstime, observer=observer))
+                coords_center = self.coords_center.transform_to(
+                    _display_frame(self._model_time_sec(), 'helioprojective'))
             self.coord_x_edit.setTextL(f'{coords_center.Tx.to(u.arcsec).value}')
             self.coord_y_edit.setTextL(f'{coords_center.Ty.to(u.arcsec).value}')
-            self.update_command_display()
+            self.update_command_display(self.hpc_radio_button)
 
     def update_hgc_state(self, checked, coords_center=None):
         """
@@ -672,12 +946,11 @@ class PyAmppGUI(QMainWindow):
             self.coord_x_label.setText("lon:")
             self.coord_y_label.setText("lat:")
             if coords_center is None:
-                obstime = Time(self.model_time_edit.dateTime().toPyDateTime())
-                observer = get_earth(obstime)
-                coords_center = self.coords_center.transform_to(HeliographicCarrington(obstime=obstime,observer=observer))
+                coords_center = self.coords_center.transform_to(
+                    _display_frame(self._model_time_sec(), 'heliographic_carrington'))
             self.coord_x_edit.setTextL(f'{coords_center.lon.to(u.deg).value}')
             self.coord_y_edit.setTextL(f'{coords_center.lat.to(u.deg).value}')
-            self.update_command_display()
+            self.update_command_display(self.hgc_radio_button)
 
     def update_hgs_state(self, checked, coords_center=None):
         """
@@ -693,11 +966,11 @@ class PyAmppGUI(QMainWindow):
             self.coord_x_label.setText("lon:")
             self.coord_y_label.setText("lat:")
             if coords_center is None:
-                obstime = Time(self.model_time_edit.dateTime().toPyDateTime())
-                coords_center = self.coords_center.transform_to(HeliographicStonyhurst(obstime=obstime))
+                coords_center = self.coords_center.transform_to(
+                    _display_frame(self._model_time_sec(), 'heliographic_stonyhurst'))
             self.coord_x_edit.setTextL(f'{coords_center.lon.to(u.deg).value}')
             self.coord_y_edit.setTextL(f'{coords_center.lat.to(u.deg).value}')
-            self.update_command_display()
+            self.update_command_display(self.hgs_radio_button)
 
     def update_coords_center(self, revert=False):
         if revert:
@@ -707,21 +980,24 @@ class PyAmppGUI(QMainWindow):
 
     @property
     def _coords_center(self):
-        time = Time(self.model_time_edit.dateTime().toPyDateTime())
         coords = [float(self.coord_x_edit.text()), float(self.coord_y_edit.text())]
+        return _make_center(self._model_time_sec(), self._checked_frame_name(), coords[0], coords[1])
+
+    def _model_time_sec(self):
+        """
+        Returns the model time as MJD in whole seconds, the key used by the cached coordinate helpers.
+        """
+        return int(round(Time(self.model_time_edit.dateTime().toPyDateTime()).mjd * 86400))
+
+    def _checked_frame_name(self):
+        """
+        Returns the name of the coordinate frame selected by the radio buttons.
+        """
         if self.hpc_radio_button.isChecked():
-            observer = get_earth(time)
-            coords_center = SkyCoord(coords[0] * u.arcsec, coords[1] * u.arcsec, obstime=time, observer=observer,
-                                     rsun=696 * u.Mm, frame='helioprojective')
+            return 'helioprojective'
         elif self.hgc_radio_button.isChecked():
-            coords_center = SkyCoord(lon=coords[0] * u.deg, lat=coords[1] * u.deg, obstime=time,
-                                     radius=696 * u.Mm,
-                                     frame='heliographic_carrington')
-        elif self.hgs_radio_button.isChecked():
-            coords_center = SkyCoord(lon=coords[0] * u.deg, lat=coords[1] * u.deg, obstime=time,
-                                     radius=696 * u.Mm,
-                                     frame='heliographic_stonyhurst')
-        return coords_center
+            return 'heliographic_carrington'
+        return 'heliographic_stonyhurst'
 
     def get_command(self):
         """
@@ -732,37 +1008,119 @@ class PyAmppGUI(QMainWindow):
         list
             The command as a list of strings.
         """
-        import astropy.time
-        import astropy.units as u
-        command = ['python', os.path.join(base_dir, 'gxbox', 'gxbox_factory.py')]
-        time = astropy.time.Time(self.model_time_edit.dateTime().toPyDateTime())
-        command += ['--time', time.to_datetime().strftime('%Y-%m-%dT%H:%M:%S')]
-
-        if self.hpc_radio_button.isChecked():
-            command += ['--coords', self.coord_x_edit.text(), self.coord_y_edit.text(), '--hpc']
-        elif self.hgc_radio_button.isChecked():
-            command += ['--coords', self.coord_x_edit.text(), self.coord_y_edit.text(), '--hgc']
-        else:
-            command += ['--coords', self.coord_x_edit.text(), self.coord_y_edit.text(), '--hgs']
-
-        command += ['--box_dims', self.grid_x_edit.text(), self.grid_y_edit.text(), self.grid_z_edit.text()]
-        command += ['--box_res', f'{((float(self.res_edit.text()) * u.km).to(u.Mm)).value:.3f}']
-        command += ['--pad_frac', f'{float(self.padding_size_edit.text()) / 100:.2f}']
-        command += ['--data_dir', self.sdo_data_edit.text()]
-        command += ['--gxmodel_dir', self.gx_model_edit.text()]
-        if self.external_box_edit.text() != '':
-            command += ['--external_box', self.external_box_edit.text()]
+        command = []
+        for name in self._cmd_part_names:
+            command += self._build_cmd_part(name)
         # print(command)
         return command
 
+    def _build_cmd_part(self, name):
+        """
+        Builds one fragment of the command from the current UI settings.
+
+        :param name: The fragment name, one of `_cmd_part_names`.
+        :type name: str
+        :return: The command fragment as a list of strings.
+        :rtype: list
+        """
+        if name == 'base':
+            return ['python', os.path.join(base_dir, 'gxbox', 'gxbox_factory.py')]
+        if name == 'time':
+            return ['--time', self.model_time_edit.dateTime().toString("yyyy-MM-dd'T'HH:mm:ss")]
+        if name == 'coords':
+            if self.hpc_radio_button.isChecked():
+                frame = '--hpc'
+            elif self.hgc_radio_button.isChecked():
+                frame = '--hgc'
+            else:
+                frame = '--hgs'
+            return ['--coords', self.coord_x_edit.text(), self.coord_y_edit.text(), frame]
+        if name == 'box_dims':
+            return ['--box_dims', self.grid_x_edit.text(), self.grid_y_edit.text(), self.grid_z_edit.text()]
+        if name == 'box_res':
+            # km to Mm
+            return ['--box_res', f'{float(self.res_edit.text()) / 1000.0:.3f}']
+        if name == 'pad_frac':
+            return ['--pad_frac', f'{float(self.padding_size_edit.text()) / 100:.2f}']
+        if name == 'data_dir':
+            return ['--data_dir', self.sdo_data_edit.text()]
+        if name == 'gxmodel_dir':
+            return ['--gxmodel_dir', self.gx_model_edit.text()]
+        if name == 'external_box':
+            if self.external_box_edit.text() != '':
+                return ['--external_box', self.external_box_edit.text()]
+            return []
+        raise ValueError(f"Unknown command fragment: {name}")
+
     def execute_command(self):
         """
         Executes the constructed command.
         """
+        if self._proc is not None and self._proc.state() != QProcess.NotRunning:
+            self.status_log_edit.append("A command is already running")
+            return
         self.status_log_edit.append("Command executed")
-        import subprocess
         command = self.get_command()
-        subprocess.run(command, check=True)
+        # Run the command without blocking the event loop and stream its output into the status log
+        self._proc = QProcess(self)
+        self._proc.setProcessChannelMode(QProcess.MergedChannels)
+        self._proc.readyReadStandardOutput.connect(self._append_stdout)
+        self._proc.finished.connect(self._on_exec_finished)
+        self._proc.errorOccurred.connect(self._on_exec_error)
+        self._proc.start(command[0], command[1:])
+        self.execute_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+
+    def cancel_command(self):
+        """
+        Stops the running command.
+        """
+        if self._proc is not None and self._proc.state() != QProcess.NotRunning:
+            self._proc.kill()
+
+    def _append_stdout(self):
+        """
+        Appends the output of the running command to the status log.
+        """
+        text = bytes(self._proc.readAllStandardOutput()).decode(errors='replace')
+        if text:
+            self.status_log_edit.append(text.rstrip('\n'))
+
+    def _on_exec_finished(self, exit_code, exit_status):
+        """
+        Reports the end of the running command.
+
+        :param exit_code: The exit code of the process.
+        :type exit_code: int
+        :param exit_status: Whether the process exited normally or crashed.
+        :type exit_status: QProcess.ExitStatus
+        """
+        if exit_status == QProcess.CrashExit:
+            self.status_log_edit.append("Command stopped")
+        else:
+            self.status_log_edit.append(f"Command finished with exit code {exit_code}")
+        self.execute_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self._proc.deleteLater()
+        self._proc = None
+
+    def _on_exec_error(self, error):
+        """
+        Reports an error of the running command.
+
+        A process that failed to start emits no ``finished`` signal, so the buttons are restored here in that case.
+
+        :param error: The error raised by the process.
+        :type error: QProcess.ProcessError
+        """
+        if self._proc is None:
+            return
+        self.status_log_edit.append(f"Command error: {self._proc.errorString()}")
+        if error == QProcess.FailedToStart:
+            self.execute_button.setEnabled(True)
+            self.cancel_button.setEnabled(False)
+            self._proc.deleteLater()
+            self._proc = None
 
     def save_command(self):
         """
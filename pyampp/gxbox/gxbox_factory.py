@@ -11,9 +11,12 @@ from sunpy.coordinates import Heliocentric, Helioprojective, get_earth, Heliogra
 from datetime import datetime, timedelta
 import os
 import glob
+import tempfile
 from pyampp.util.config import *
+from pyampp.util.config import available_cpu_count
 from pyampp.data import downloader
-from pyampp.gxbox.boxutils import hmi_disambig, hmi_b2ptr
+from pyampp.gxbox.boxutils import hmi_disambig, hmi_b2ptr, read_b3d_h5, write_b3d_h5, hcc_to_hpc, \
+    hcc_to_hpc_rotation, fieldline_segments, _b2ptr_geometry
 import sys
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QLabel, \
     QPushButton, QSlider, QLineEdit, QCheckBox, QMessageBox, QGroupBox,QToolButton
@@ -24,24 +27,47 @@ import argparse
 from astropy.time import Time
 from pathlib import Path
 import locale
-from streamtracer import StreamTracer, VectorGrid
 import pyampp
 from pyampp.util.lff import mf_lfff
-from pyampp.util.MagFieldWrapper import MagFieldWrapper
-from pyampp.util.radio import GXRadioImageComputing
-from pyampp.gxbox.magfield_viewer import MagFieldViewer
 import pickle
 import matplotlib.cm as cm
-import matplotlib.colors as mcolors
-import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 
 base_dir = Path(pyampp.__file__).parent
 nlfff_libpath = Path(base_dir / 'lib' / 'nlfff' / 'binaries' / 'WWNLFFFReconstruction.so').resolve()
 radio_libpath = Path(base_dir / 'lib' / 'grff' / 'binaries' / 'RenderGRFF.so').resolve()
 
-os.environ['OMP_NUM_THREADS'] = '16'  # number of parallel threads
 locale.setlocale(locale.LC_ALL, "C");
 
+# Colormap of the fieldline overlay, looked up once instead of on every plot, its RGBA table, and the field
+# strength range [G] the table spans
+_FIELDLINE_CMAP = plt.get_cmap('viridis')
+_FIELDLINE_LUT = _FIELDLINE_CMAP(np.arange(_FIELDLINE_CMAP.N))
+_FIELDLINE_LUT.setflags(write=False)
+_FIELDLINE_B_RANGE = (0., 1000.)
+
+# Unit corner signs of a box, in itertools.product order, and the 12 corner pairs that differ in exactly one
+# coordinate (the box edges)
+_CORNER_SIGNS = np.array(list(itertools.product([-1, 1], repeat=3)), dtype=np.float64)
+_EDGE_PAIRS = np.array([(i, j) for i in range(8) for j in range(i + 1, 8) if bin(i ^ j).count('1') == 1])
+_CORNER_SIGNS.setflags(write=False)
+_EDGE_PAIRS.setflags(write=False)
+
+
+# HMI B segments the vector products are computed from; the azimuth brings in the disambig segment it needs
+_HMI_B_PRODUCT_SEGMENTS = ('field', 'inclination', 'azimuth')
+
+
+class _B3D:
+    """
+    Holds the 3D magnetic field cubes of a box, one attribute per model type. Each is None until computed or loaded.
+    """
+    __slots__ = ('lfff', 'nlfff')
+
+    def __init__(self):
+        self.lfff = None
+        self.nlfff = None
+
 
 ## todo add chrom mask to the tool
 class Box:
@@ -63,10 +89,10 @@ class Box:
         List containing tuples representing the corner points of the box in the specified units.
     edges : list of tuple
         List containing tuples that represent the edges of the box by connecting the corners.
-    bottom_edges : list of `SkyCoord`
-        A list containing the bottom edges of the box calculated based on the minimum z-coordinate value.
-    non_bottom_edges : list of `SkyCoord`
-        A list containing all edges of the box that are not classified as bottom edges.
+    bottom_edges : `SkyCoord`
+        The bottom edges of the box calculated based on the minimum z-coordinate value, of shape (N, 2).
+    non_bottom_edges : `SkyCoord`
+        All edges of the box that are not classified as bottom edges, of shape (N, 2).
 
     Methods
     -------
@@ -102,20 +128,43 @@ class Box:
         self._dims = box_dims
         self._res = box_res
         self._dims_pix = np.int_(np.round(self._dims / self._res.to(self._dims.unit)))
-        # Generate corner points based on the dimensions
-        self.corners = list(itertools.product(self._dims[0] / 2 * [-1, 1],
-                                              self._dims[1] / 2 * [-1, 1],
-                                              self._dims[2] / 2 * [-1, 1]))
-
-        # Identify edges as pairs of corners differing by exactly one dimension
-        self.edges = [edge for edge in itertools.combinations(self.corners, 2)
-                      if np.count_nonzero(u.Quantity(edge[0]) - u.Quantity(edge[1])) == 1]
+        # Corner points offset from the box center, as a plain (8, 3) array in the unit of the box dimensions
+        self._corners_arr = _CORNER_SIGNS * (self._dims.value / 2)
         # Initialize properties to store categorized edges
+        self._bottom_cea_header = None
+        self._grid_coords = None
+        self._all_edges = None
+        self._all_edges_obs = None
+        self._bottom_edges_obs = None
         self._bottom_edges = None
         self._non_bottom_edges = None
         self._calculate_edge_types()  # Categorize edges upon initialization
-        self.b3dtype = ['lfff', 'nlfff']
-        self.b3d = {b3dtype: None for b3dtype in self.b3dtype}
+        self.b3dtype = list(_B3D.__slots__)
+        self.b3d = _B3D()
+        # Field grid of the 3D viewer, kept so that reopening the viewer on this box reuses it
+        self.viewer_grid_cache = {}
+
+    @property
+    def corners(self):
+        """
+        Corner points of the box relative to its center.
+
+        :return: List of (x, y, z) tuples of `~astropy.units.Quantity`.
+        :rtype: list of tuple
+        """
+        corners = self._corners_arr * self._dims.unit
+        return [tuple(corner) for corner in corners]
+
+    @property
+    def edges(self):
+        """
+        Edges of the box as pairs of corners.
+
+        :return: List of tuples containing the two corner points of each edge.
+        :rtype: list of tuple
+        """
+        corners = self.corners
+        return [(corners[i], corners[j]) for i, j in _EDGE_PAIRS]
 
     @property
     def dims_pix(self):
@@ -123,16 +172,27 @@ class Box:
 
     @property
     def grid_coords(self):
-        return self._get_grid_coords(self._center)
+        """
+        Grid axes of the box, computed once.
+
+        :return: Dictionary with the 1D grid axes 'x', 'y' and 'z' as float arrays in the shared 'unit', and the
+            observer 'frame'. The axes are not expanded to a full 3D grid; broadcast them (e.g. with `numpy.ix_`)
+            where the point triples are needed.
+        :rtype: dict
+        """
+        if self._grid_coords is None:
+            self._grid_coords = self._get_grid_coords(self._center)
+        return self._grid_coords
 
     def _get_grid_coords(self, grid_center):
-        grid_coords = {}
-        grid_coords['x'] = np.linspace(grid_center.x.to(self._dims.unit) - self._dims[0] / 2,
-                                       grid_center.x.to(self._dims.unit) + self._dims[0] / 2, self._dims_pix[0])
-        grid_coords['y'] = np.linspace(grid_center.y.to(self._dims.unit) - self._dims[1] / 2,
-                                       grid_center.y.to(self._dims.unit) + self._dims[1] / 2, self._dims_pix[1])
-        grid_coords['z'] = np.linspace(grid_center.z.to(self._dims.unit) - self._dims[2] / 2,
-                                       grid_center.z.to(self._dims.unit) + self._dims[2] / 2, self._dims_pix[2])
+        unit = self._dims.unit
+        grid_coords = {'unit': unit}
+        half_dims = self._dims.to_value(unit) / 2
+        # dims_pix is a dimensionless Quantity; linspace gets plain integer sample counts
+        num = np.asarray(self._dims_pix, dtype=int)
+        for i, axis in enumerate('xyz'):
+            c = getattr(grid_center, axis).to_value(unit)
+            grid_coords[axis] = np.linspace(c - half_dims[i], c + half_dims[i], int(num[i]))
         grid_coords['frame'] = self._frame_obs
         return grid_coords
 
@@ -140,17 +200,18 @@ class Box:
         """
         Translates edge corner points to their corresponding SkyCoord based on the box's origin.
 
-        :param edges: List of tuples, each tuple contains two corner points defining an edge.
-        :type edges: list of tuple
+        :param edges: Corner offsets of the edges from the box center, of shape (N, 2, 3).
+        :type edges: `~astropy.units.Quantity`
         :param box_center: The origin point of the box in the specified coordinate frame as a `SkyCoord`.
         :type box_center: `~astropy.coordinates.SkyCoord`
-        :return: List of `SkyCoord` coordinates of edges in the box's frame.
-        :rtype: list of `~astropy.coordinates.SkyCoord`
+        :return: Coordinates of the edges in the box's frame, of shape (N, 2); indexing the first axis gives one edge.
+        :rtype: `~astropy.coordinates.SkyCoord`
         """
-        return [SkyCoord(x=box_center.x + u.Quantity([edge[0][0], edge[1][0]]),
-                         y=box_center.y + u.Quantity([edge[0][1], edge[1][1]]),
-                         z=box_center.z + u.Quantity([edge[0][2], edge[1][2]]),
-                         frame=box_center.frame) for edge in edges]
+        unit = edges.unit
+        center = np.array([box_center.x.to_value(unit), box_center.y.to_value(unit), box_center.z.to_value(unit)])
+        xyz = edges.to_value(unit) + center
+        return SkyCoord(x=xyz[..., 0] << unit, y=xyz[..., 1] << unit, z=xyz[..., 2] << unit,
+                        frame=box_center.frame)
 
     # def _get_bottom_bl_tr_coords(self,box_center):
     #     return [SkyCoord(x=box_center.x - self._box_dims[0] / 2,
@@ -162,12 +223,10 @@ class Box:
         :rtype: dict
         """
         origin = self._origin.transform_to(HeliographicStonyhurst)
-        shape = self._dims[:-1][::-1] / self._res.to(self._dims.unit)
-        shape = list(shape.value)
+        shape = self._dims[:-1][::-1].to_value(self._res.unit) / self._res.value
         shape = [int(np.ceil(s)) for s in shape]
-        rsun = origin.rsun.to(self._res.unit)
-        scale = np.arcsin(self._res / rsun).to(u.deg) / u.pix
-        scale = u.Quantity((scale, scale))
+        scale = np.rad2deg(np.arcsin(self._res.value / origin.rsun.to_value(self._res.unit)))
+        scale = u.Quantity((scale, scale), u.deg / u.pix)
         # bottom_cea_header = make_fitswcs_header(shape, origin,
         #                                         scale=scale, observatory=self._origin.observer, projection_code='CEA')
         bottom_cea_header = make_fitswcs_header(shape, origin,
@@ -180,22 +239,25 @@ class Box:
         """
         Separates the box's edges into bottom edges and non-bottom edges. This is done in a single pass to improve efficiency.
         """
-        min_z = min(corner[2] for corner in self.corners)
-        bottom_edges, non_bottom_edges = [], []
-        for edge in self.edges:
-            if edge[0][2] == min_z and edge[1][2] == min_z:
-                bottom_edges.append(edge)
-            else:
-                non_bottom_edges.append(edge)
-        self._bottom_edges = self._get_edge_coords(bottom_edges, self._center)
-        self._non_bottom_edges = self._get_edge_coords(non_bottom_edges, self._center)
+        # Bottom edges are the ones with both corners at the minimum z
+        edges = self._corners_arr[_EDGE_PAIRS]
+        is_bottom = (edges[..., 2] == self._corners_arr[:, 2].min()).all(axis=1)
+        self._n_bottom_edges = int(is_bottom.sum())
+        # All edges go through SkyCoord at once, bottom edges first
+        edges = np.concatenate([edges[is_bottom], edges[~is_bottom]])
+        self._all_edges = self._get_edge_coords(edges << self._dims.unit, self._center)
+        self._bottom_edges = self._all_edges[:self._n_bottom_edges]
+        self._non_bottom_edges = self._all_edges[self._n_bottom_edges:]
+        # The box and observer frame are fixed, so the observer-frame edges used by the bounds are computed once
+        self._all_edges_obs = self._all_edges.transform_to(self._frame_obs)
+        self._bottom_edges_obs = self._all_edges_obs[:self._n_bottom_edges]
 
     def _get_bounds_coords(self, edges, bltr=False, pad_frac=0.0):
         """
         Provides the bounding box of the edges in solar x and y.
 
-        :param edges: List of tuples, each tuple contains two corner points defining an edge.
-        :type edges: list of tuple
+        :param edges: Coordinates of the edges in the observer frame, of shape (N, 2).
+        :type edges: `~astropy.coordinates.SkyCoord`
         :param bltr: If True, returns bottom left and top right coordinates, otherwise returns minimum and maximum coordinates.
         :type bltr: bool, optional
         :param pad_frac: Fractional padding applied to each side of the box, expressed as a decimal, defaults to 0.0.
@@ -204,18 +266,15 @@ class Box:
         :return: Coordinates of the box's bounds.
         :rtype: list of `~astropy.coordinates.SkyCoord`
         """
-        xx = []
-        yy = []
-        for edge in edges:
-            xx.append(edge.transform_to(self._frame_obs).Tx)
-            yy.append(edge.transform_to(self._frame_obs).Ty)
-        unit = xx[0][0].unit
-        min_x = np.min(xx)
-        max_x = np.max(xx)
-        min_y = np.min(yy)
-        max_y = np.max(yy)
+        unit = edges.Tx.unit
+        xx = edges.Tx.to_value(unit)
+        yy = edges.Ty.to_value(unit)
+        min_x = xx.min()
+        max_x = xx.max()
+        min_y = yy.min()
+        max_y = yy.max()
         if pad_frac > 0:
-            _pad = pad_frac * np.max([max_x - min_x, max_y - min_y, 20])
+            _pad = pad_frac * max(max_x - min_x, max_y - min_y, 20)
             min_x -= _pad
             max_x += _pad
             min_y -= _pad
@@ -239,7 +298,7 @@ class Box:
         :return: Bottom left and top right coordinates of the box in the observer frame.
         :rtype: list of `~astropy.coordinates.SkyCoord`
         """
-        return self._get_bounds_coords(self.all_edges, bltr=True, pad_frac=pad_frac)
+        return self._get_bounds_coords(self._all_edges_obs, bltr=True, pad_frac=pad_frac)
 
     @property
     def bounds_coords(self):
@@ -249,7 +308,7 @@ class Box:
         :return: Coordinates of the box's bounds.
         :rtype: `~astropy.coordinates.SkyCoord`
         """
-        return self._get_bounds_coords(self.all_edges)
+        return self._get_bounds_coords(self._all_edges_obs)
 
     @property
     def bottom_bounds_coords(self):
@@ -259,25 +318,29 @@ class Box:
         :return: Coordinates of the box's bottom bounds.
         :rtype: `~astropy.coordinates.SkyCoord`
         """
-        return self._get_bounds_coords(self.bottom_edges)
+        return self._get_bounds_coords(self._bottom_edges_obs)
 
     @property
     def bottom_cea_header(self):
         """
         Provides access to the box's bottom WCS CEA header.
 
+        The header is built once; each access returns a copy, so callers may modify it.
+
         :return: The WCS CEA header for the box's bottom.
         :rtype: dict
         """
-        return self._get_bottom_cea_header()
+        if self._bottom_cea_header is None:
+            self._bottom_cea_header = self._get_bottom_cea_header()
+        return self._bottom_cea_header.copy()
 
     @property
     def bottom_edges(self):
         """
         Provides access to the box's bottom edge coordinates.
 
-        :return: Coordinates of the box's bottom edges.
-        :rtype: list of `~astropy.coordinates.SkyCoord`
+        :return: Coordinates of the box's bottom edges, of shape (N, 2).
+        :rtype: `~astropy.coordinates.SkyCoord`
         """
         return self._bottom_edges
 
@@ -286,8 +349,8 @@ class Box:
         """
         Provides access to the box's non-bottom edge coordinates.
 
-        :return: Coordinates of the box's non-bottom edges.
-        :rtype: list of `~astropy.coordinates.SkyCoord`
+        :return: Coordinates of the box's non-bottom edges, of shape (N, 2).
+        :rtype: `~astropy.coordinates.SkyCoord`
         """
         return self._non_bottom_edges
 
@@ -296,10 +359,10 @@ class Box:
         """
         Provides access to all the edge coordinates of the box, combining both bottom and non-bottom edges.
 
-        :return: Coordinates of all the edges of the box.
-        :rtype: list of `~astropy.coordinates.SkyCoord`
+        :return: Coordinates of all the edges of the box, of shape (12, 2), bottom edges first.
+        :rtype: `~astropy.coordinates.SkyCoord`
         """
-        return self._bottom_edges + self._non_bottom_edges
+        return self._all_edges
 
     @property
     def box_origin(self):
@@ -388,21 +451,35 @@ class GxBox(QMainWindow):
         ## this is the origin of the box, i.e., the center of the box bottom
         self.box_origin = box_orig
         self.sdofitsfiles = None
+        self._invalidate_avaliable_maps()
+        self._reproject_cache = {}
         self.frame_hcc = Heliocentric(observer=self.box_origin, obstime=self.time)
         self.frame_obs = Helioprojective(observer=self.observer, obstime=self.time)
+        # Rotation from frame_hcc to frame_obs, resolved on the first fieldline plot
+        self._hcc_to_hpc_rotation = None
         self.frame_hgs = HeliographicStonyhurst(obstime=self.time)
         self.lines_of_sight = []
         self.edge_coords = []
         self.axes = None
+        self._axes_map_context = None
+        self._box_outline_artists = []
+        self._bound_box_artist = None
         self.fig = None
         self.axes_world_coords = None
         self.axes_world_coords_init = None
         self.init_map_context_name = '171'
         self.init_map_bottom_name = 'field'
         self.external_box = external_box
+        # Plotted fieldlines, one dict of flat per-point arrays (coords_hcc_xyz, bx, by, bz, magnitude) and the
+        # line_starts offsets per entry of fieldlines_line_collection, and cleared together with it
         self.fieldlines_coords = []
         self.fieldlines_line_collection = []  # Initialize an empty list to store LineCollections
         self.fieldlines_show_status = True  # Initial status of the fieldlines visibility
+        # Canvas pixels saved after the last full draw, the fieldline collections they already show and the axes
+        # limits they were drawn with
+        self._canvas_background = None
+        self._canvas_background_lines = []
+        self._canvas_background_lims = None
         self.map_context_im = None
         self.map_bottom_im = None
 
@@ -424,11 +501,14 @@ class GxBox(QMainWindow):
         self.fov_coords = self.box.bounds_coords_bl_tr(pad_frac=self.pad_frac)
         # print(f"Bottom left: {self.fov_coords[0]}; Top right: {self.fov_coords[1]}")
 
-        if not all([coordinate_is_on_solar_disk(coord) for coord in self.fov_coords]):
+        fov_corners = SkyCoord(Tx=u.Quantity([coord.Tx for coord in self.fov_coords]),
+                               Ty=u.Quantity([coord.Ty for coord in self.fov_coords]), frame=self.frame_obs)
+        if not np.all(coordinate_is_on_solar_disk(fov_corners)):
             print("Warning: Some of the box corners are not on the solar disk. Please check the box dimensions.")
 
         download_sdo = downloader.SDOImageDownloader(time, data_dir=data_dir)
         self.sdofitsfiles = download_sdo.download_images()
+        self._invalidate_avaliable_maps()
         self.sdomaps = {}
 
         self.sdomaps[self.init_map_context_name] = self.loadmap(self.init_map_context_name)
@@ -437,17 +517,89 @@ class GxBox(QMainWindow):
         self.sdomaps[self.init_map_bottom_name] = self.loadmap(self.init_map_bottom_name)
 
         # print(self.bottom_wcs_header)
-        self.map_bottom = self.sdomaps[self.init_map_bottom_name].reproject_to(self.bottom_wcs_header,
-                                                                               algorithm="adaptive",
-                                                                               roundtrip_coords=False)
+        self.map_bottom = self.reproject_to_bottom(self.sdomaps[self.init_map_bottom_name])
 
         self.init_ui()
 
     def load_gxbox(self, boxfile):
-        with open(boxfile, 'rb') as f:
-            gxboxdata = pickle.load(f)
-            for b3dtype in self.box.b3dtype:
-                self.box.b3d[b3dtype] = gxboxdata['b3d'][b3dtype] if b3dtype in gxboxdata['b3d'].keys() else None
+        """
+        Loads the 3D magnetic field cubes of an external box file into the box.
+
+        HDF5 files (.h5, .hdf5) are read directly. Pickled .gxbox files are still supported but slow to load; their
+        cubes are converted once to an HDF5 file next to them (same name, .gxbox.h5 extension), which is read instead
+        on later loads as long as it is newer than the pickle and holds the bx, by, bz cubes of known model types.
+
+        :param boxfile: Path to the box file.
+        :type boxfile: str
+        """
+        if os.path.splitext(boxfile)[1].lower() in ('.h5', '.hdf5'):
+            b3d = read_b3d_h5(boxfile)
+        else:
+            h5file = os.path.splitext(boxfile)[0] + '.gxbox.h5'
+            b3d = None
+            if os.path.exists(h5file) and os.path.getmtime(h5file) >= os.path.getmtime(boxfile):
+                try:
+                    b3d = read_b3d_h5(h5file)
+                except Exception as e:
+                    print(f"Warning: could not read {h5file}: {e}")
+                if b3d is not None and not self._is_complete_b3d(b3d):
+                    print(f"Warning: {h5file} does not match the box layout; loading {boxfile} instead.")
+                    b3d = None
+            if b3d is None:
+                print(f"Warning: {boxfile} is a pickled box; loading it through pickle. HDF5 box files load faster.")
+                with open(boxfile, 'rb') as f:
+                    b3d = pickle.load(f)['b3d']
+                self._write_b3d_cache(h5file, b3d)
+        for b3dtype in self.box.b3dtype:
+            setattr(self.box.b3d, b3dtype, b3d.get(b3dtype))
+
+    def _is_complete_b3d(self, b3d):
+        """
+        Checks that `b3d` holds at least one model type of the box, each with its bx, by and bz cubes.
+
+        :param b3d: Mapping of model type to a dict of field components.
+        :type b3d: dict
+        :return: True if `b3d` can be loaded into the box.
+        :rtype: bool
+        """
+        return bool(b3d) and all(b3dtype in self.box.b3dtype and all(key in components for key in ('bx', 'by', 'bz'))
+                                 for b3dtype, components in b3d.items())
+
+    def _write_b3d_cache(self, h5file, b3d):
+        """
+        Writes the cubes of a pickled box to `h5file`, atomically, so that an interrupted write never leaves a partial
+        file behind.
+
+        :param h5file: Path to the HDF5 file.
+        :type h5file: str
+        :param b3d: Mapping of model type to a dict of field components, as stored in the pickle.
+        :type b3d: dict
+        """
+        tmpfile = None
+        try:
+            fd, tmpfile = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(h5file) + '.',
+                                           dir=os.path.dirname(os.path.abspath(h5file)))
+            os.close(fd)
+            # Keep the stored dtype so the converted cubes are identical to the pickled ones
+            write_b3d_h5(tmpfile, {b3dtype: b3d.get(b3dtype) for b3dtype in self.box.b3dtype}, dtype=None)
+            os.replace(tmpfile, h5file)
+        except Exception as e:
+            print(f"Warning: could not write {h5file}: {e}")
+            if tmpfile is not None and os.path.exists(tmpfile):
+                os.remove(tmpfile)
+
+    def _invalidate_avaliable_maps(self):
+        """
+        Recomputes the list of available maps. Must be called whenever `sdofitsfiles` changes.
+        """
+        if self.sdofitsfiles is None:
+            maps = []
+        elif all(key in self.sdofitsfiles for key in HMI_B_SEGMENTS):
+            maps = list(self.sdofitsfiles.keys()) + HMI_B_PRODUCTS
+        else:
+            maps = list(self.sdofitsfiles.keys())
+        self._avaliable_maps = maps
+        self._avaliable_maps_set = frozenset(maps)
 
     @property
     def avaliable_maps(self):
@@ -457,10 +609,7 @@ class GxBox(QMainWindow):
         :return: A list of available map keys.
         :rtype: list
         """
-        if all(key in self.sdofitsfiles.keys() for key in HMI_B_SEGMENTS):
-            return list(self.sdofitsfiles.keys()) + HMI_B_PRODUCTS
-        else:
-            return self.sdofitsfiles.keys()
+        return self._avaliable_maps
 
     def corr_fov_coords(self, sunpymap, fov_coords):
         '''
@@ -519,34 +668,33 @@ class GxBox(QMainWindow):
         :return: The requested map.
         :raises ValueError: If the specified map is not available.
         """
-        if mapname not in self.avaliable_maps:
+        if mapname not in self._avaliable_maps_set:
             raise ValueError(f"Map {mapname} is not available. mapname must be one of {self.avaliable_maps}")
 
-        if mapname in self.sdomaps.keys():
-            return self.sdomaps[mapname]
+        sdomaps = self.sdomaps
+        if mapname in sdomaps:
+            return sdomaps[mapname]
 
         if fov_coords is None:
             fov_coords = self.fov_coords
 
         if mapname in HMI_B_SEGMENTS:
-            self._load_hmi_b_seg_maps(mapname, fov_coords)
+            return self._load_hmi_b_seg_maps(mapname, fov_coords)
 
         if mapname in HMI_B_PRODUCTS:
-            for key in HMI_B_SEGMENTS:
-                if key not in self.sdomaps.keys():
-                    self.sdomaps[key] = self._load_hmi_b_seg_maps(key, fov_coords)
-            map_bp, map_bt, map_br = hmi_b2ptr(self.sdomaps['field'], self.sdomaps['inclination'],
-                                               self.sdomaps['azimuth'])
-            self.sdomaps['bp'] = map_bp
-            self.sdomaps['bt'] = map_bt
-            self.sdomaps['br'] = map_br
-            return self.sdomaps[mapname]
+            # hmi_b2ptr returns all three components at once, so all of them are stored
+            for key in _HMI_B_PRODUCT_SEGMENTS:
+                if key not in sdomaps:
+                    sdomaps[key] = self._load_hmi_b_seg_maps(key, fov_coords)
+            sdomaps['bp'], sdomaps['bt'], sdomaps['br'] = hmi_b2ptr(*(sdomaps[key] for key in _HMI_B_PRODUCT_SEGMENTS))
+            return sdomaps[mapname]
 
         # Load general maps
         loaded_map = Map(self.sdofitsfiles[mapname])
         fov_coords = self.corr_fov_coords(loaded_map, fov_coords)
-        self.sdomaps[mapname] = loaded_map.submap(fov_coords[0], top_right=fov_coords[1])
-        return self.sdomaps[mapname]
+        loaded_map = loaded_map.submap(fov_coords[0], top_right=fov_coords[1])
+        sdomaps[mapname] = loaded_map
+        return loaded_map
 
     def make_dummy_map(self, ref_coord):
         """
@@ -580,6 +728,7 @@ class GxBox(QMainWindow):
         # Matplotlib Figure
         self.fig = plt.Figure()
         self.canvas = FigureCanvas(self.fig)
+        self.canvas.mpl_connect('draw_event', self._on_canvas_draw)
         main_layout.addWidget(self.canvas)
 
         # Add Matplotlib Navigation Toolbar
@@ -656,7 +805,7 @@ class GxBox(QMainWindow):
         if self.box.b3d is {}:
             maglib_lff = mf_lfff()
             maglib_lff.set_field(self.map_bottom.data)
-            self.box.b3d['lfff'] = maglib_lff.lfff_cube(self.box.dims_pix[-1].value)
+            self.box.b3d.lfff = maglib_lff.lfff_cube(self.box.dims_pix[-1].value, dtype=np.float32)
 
         ## todo add external box import. using boundary map to update box input at pyampp..
         # import time
@@ -727,10 +876,36 @@ class GxBox(QMainWindow):
         """
         Launches the MagneticFieldVisualizer to visualize the 3D magnetic field data.
         """
+        # pyvista/VTK are only imported once the 3D viewer is opened, keeping them off the start-up path
+        from pyampp.gxbox.magfield_viewer import MagFieldViewer
 
         self.visualizer = MagFieldViewer(self.box, self)
         self.visualizer.show()
 
+    def reproject_to_bottom(self, sunpymap):
+        """
+        Reprojects a map onto the CEA grid of the box bottom.
+
+        On multi-core machines the output is split into blocks that reproject evaluates in parallel threads.
+        Results are cached per source map and bottom header, so switching back to a map does not reproject it again.
+
+        :param sunpymap: The map to reproject.
+        :type sunpymap: sunpy.map.Map
+        :return: The reprojected map.
+        :rtype: sunpy.map.Map
+        """
+        # The header only changes if the box does; the source map is kept in the entry so its id stays valid
+        key = (id(sunpymap), repr(sorted(self.bottom_wcs_header.items())))
+        cached = self._reproject_cache.get(key)
+        if cached is not None and cached[0] is sunpymap:
+            return cached[1]
+        ncpu = available_cpu_count()
+        parallel_args = dict(parallel=ncpu, block_size='auto') if ncpu > 1 else {}
+        reprojected = sunpymap.reproject_to(self.bottom_wcs_header, algorithm="adaptive", roundtrip_coords=False,
+                                            **parallel_args)
+        self._reproject_cache[key] = (sunpymap, reprojected)
+        return reprojected
+
     def update_bottom_map(self, map_name):
         """
         Updates the bottom map displayed in the UI.
@@ -741,8 +916,7 @@ class GxBox(QMainWindow):
         if self.map_bottom_im is not None:
             self.map_bottom_im.remove()
         map_bottom = self.sdomaps[map_name] if map_name in self.sdomaps.keys() else self.loadmap(map_name)
-        self.map_bottom = map_bottom.reproject_to(self.bottom_wcs_header, algorithm="adaptive",
-                                                  roundtrip_coords=False)
+        self.map_bottom = self.reproject_to_bottom(map_bottom)
         self.map_bottom_im = self.map_bottom.plot(axes=self.axes, autoalign=True)
         # self.update_plot()
         self.canvas.draw()
@@ -796,24 +970,63 @@ class GxBox(QMainWindow):
         else:
             self.toggle_fieldlines_button.setText("Show")
 
-        self.canvas.draw()
+        self._redraw_fieldlines()
 
     def clear_fieldlines(self):
         """
         Clears the fieldlines from the plot.
         """
+        self.fieldlines_coords = []
         if len(self.fieldlines_line_collection) == 0:
             return
 
         while self.fieldlines_line_collection:
             lc = self.fieldlines_line_collection.pop()
             lc.remove()  # Remove the LineCollection from the axes
-        self.canvas.draw()
+        self._redraw_fieldlines()
+
+    def _on_canvas_draw(self, event):
+        """
+        Saves the canvas after every full draw, so fieldline overlays can later be added on top of it by blitting.
+        """
+        self._canvas_background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._canvas_background_lines = [lc for lc in self.fieldlines_line_collection if lc.get_visible()]
+        self._canvas_background_lims = (self.axes.get_xlim(), self.axes.get_ylim()) if self.axes is not None else None
+
+    def _redraw_fieldlines(self):
+        """
+        Brings the canvas up to date after fieldline overlays were added, shown, hidden or removed.
+
+        Overlays missing from the saved background are drawn onto it and blitted, which avoids re-rendering the maps,
+        grid and box outlines. The canvas is fully redrawn when a line in the background has to disappear, or when the
+        axes limits changed since the background was saved (e.g. autoscaling to a newly added collection).
+        """
+        shown = [lc for lc in self.fieldlines_line_collection if lc.get_visible()]
+        if (self._canvas_background is None
+                or any(lc not in shown for lc in self._canvas_background_lines)
+                or self._canvas_background_lims != (self.axes.get_xlim(), self.axes.get_ylim())):
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self._canvas_background)
+        for lc in shown:
+            if lc not in self._canvas_background_lines:
+                self.axes.draw_artist(lc)
+        self.canvas.blit(self.fig.bbox)
 
     def update_plot(self, show_bound_box=True, show_box_outline=True):
         """
         Updates the plot with the current data and settings.
+
+        The axes are only rebuilt when the context map, and with it the axes projection, has changed since the last
+        call; otherwise the existing artists are kept and only the box overlays are shown or hidden.
         """
+        if self.axes is not None and self._axes_map_context is self.map_context:
+            for artist in self._box_outline_artists:
+                artist.set_visible(show_box_outline)
+            self._bound_box_artist.set_visible(show_bound_box)
+            self.canvas.draw()
+            return
+
         if self.axes is not None:
             self.axes_world_coords = self.get_axes_world_coords
         self.fig.clear()
@@ -827,25 +1040,28 @@ class GxBox(QMainWindow):
         #     ax.plot_coord(edge, color='r', ls='-', marker='', lw=1.0)
         # for edge in self.simbox.non_bottom_edges:
         #     ax.plot_coord(edge, color='r', ls='--', marker='', lw=0.5)
-        if show_box_outline:
-            for edge in self.box.bottom_edges:
-                ax.plot_coord(edge, color='tab:red', ls='--', marker='', lw=1.0)
-            for edge in self.box.non_bottom_edges:
-                ax.plot_coord(edge, color='tab:red', ls='-', marker='', lw=1.0)
+        # The overlays are always drawn and hidden as requested, so later calls can just toggle them
+        self._box_outline_artists = []
+        for edge in self.box.bottom_edges:
+            self._box_outline_artists += ax.plot_coord(edge, color='tab:red', ls='--', marker='', lw=1.0)
+        for edge in self.box.non_bottom_edges:
+            self._box_outline_artists += ax.plot_coord(edge, color='tab:red', ls='-', marker='', lw=1.0)
+        for artist in self._box_outline_artists:
+            artist.set_visible(show_box_outline)
         # self.map_context.draw_quadrangle(self.map_bottom.bottom_left_coord, axes=ax,
         #                                  width=self.map_bottom.top_right_coord.lon - self.map_bottom.bottom_left_coord.lon,
         #                                  height=self.map_bottom.top_right_coord.lat - self.map_bottom.bottom_left_coord.lat,
         #                                  edgecolor='tab:red', linestyle='--', linewidth=0.5)
         # ax.plot_coord(self.box_center, color='r', marker='+')
         # ax.plot_coord(self.box_origin, mec='r', mfc='none', marker='o')
-        if show_bound_box:
-            self.map_context.draw_quadrangle(
-                self.box.bounds_coords,
-                axes=ax,
-                edgecolor="tab:blue",
-                linestyle="--",
-                linewidth=0.5,
-            )
+        self._bound_box_artist = self.map_context.draw_quadrangle(
+            self.box.bounds_coords,
+            axes=ax,
+            edgecolor="tab:blue",
+            linestyle="--",
+            linewidth=0.5,
+        )
+        self._bound_box_artist.set_visible(show_bound_box)
         self.map_bottom_im = self.map_bottom.plot(axes=ax, autoalign=True)
         ax.set_title(ax.get_title(), pad=45)
         if self.axes_world_coords_init is None:
@@ -855,6 +1071,11 @@ class GxBox(QMainWindow):
             ax.set_xlim(axes_pixel_coords[0])
             ax.set_ylim(axes_pixel_coords[1])
         self.fig.tight_layout()
+        self._axes_map_context = self.map_context
+        # Clearing the figure removed the fieldline overlays along with the old axes; drop their records too so
+        # fieldlines_coords only describes the lines that are on the plot
+        self.fieldlines_line_collection = []
+        self.fieldlines_coords = []
         # Refresh canvas
         self.canvas.draw()
 
@@ -867,23 +1088,23 @@ class GxBox(QMainWindow):
         :return: list of numpy.ndarray
             A list of individual streamlines.
         """
-        lines = []
-        fields = []
-        n_lines = streamlines.lines.shape[0]
-        i = 0
-        while i < n_lines:
-            num_points = streamlines.lines[i]
-            start_idx = streamlines.lines[i + 1]
-            end_idx = start_idx + num_points
-            line = streamlines.points[start_idx:end_idx]
-            lines.append(line)
-            bx = streamlines['bx'][start_idx:end_idx]
-            by = streamlines['by'][start_idx:end_idx]
-            bz = streamlines['bz'][start_idx:end_idx]
-            magnitude = np.sqrt(bx ** 2 + by ** 2 + bz ** 2)
-
-            fields.append({'bx': bx, 'by': by, 'bz': bz, 'magnitude': magnitude})
-            i += num_points + 1
+        from vtkmodules.util.numpy_support import vtk_to_numpy
+
+        # VTK keeps the polylines as an offsets array into a flat point-id connectivity array; the tracer writes the
+        # points of each line consecutively, so a line is the slice starting at its first point id.
+        cells = streamlines.GetLines()
+        offsets = vtk_to_numpy(cells.GetOffsetsArray())
+        starts = vtk_to_numpy(cells.GetConnectivityArray())[offsets[:-1]]
+        ends = starts + np.diff(offsets)
+
+        points = streamlines.points
+        bx, by, bz = streamlines['bx'], streamlines['by'], streamlines['bz']
+        b = np.stack([bx, by, bz], axis=1)
+        magnitude = np.sqrt(np.einsum('ij,ij->i', b, b))
+
+        lines = [points[i:j] for i, j in zip(starts, ends)]
+        fields = [{'bx': bx[i:j], 'by': by[i:j], 'bz': bz[i:j], 'magnitude': magnitude[i:j]}
+                  for i, j in zip(starts, ends)]
         return lines, fields
 
     def plot_fieldlines(self, streamlines, z_base=0.0):
@@ -893,32 +1114,42 @@ class GxBox(QMainWindow):
         :param streamlines: pyvista.PolyData
             The streamlines data.
         """
-        from matplotlib.collections import LineCollection
         coords, fields = self.extract_streamlines(streamlines)
         ax = self.axes
-        # Normalize the magnitude values for colormap
-        norm = mcolors.Normalize(vmin=0, vmax=1000)
-        cmap = plt.get_cmap('viridis')
-
-        for coord, field in zip(coords, fields):
-            # Convert the streamline coordinates to the gxbox frame_obs
-            coord_hcc = SkyCoord(x=coord[:, 0] * u.Mm, y=coord[:, 1] * u.Mm, z=(coord[:, 2] + z_base) * u.Mm,
-                                 frame=self.frame_hcc)
-            coord_hpc = coord_hcc.transform_to(self.frame_obs)
-            # ax.plot_coord(coord_hpc, '-', c='tab:blue', lw=0.3, alpha=0.5)
-            xpix, ypix = self.map_context.world_to_pixel(coord_hpc)
-            x = xpix.value
-            y = ypix.value
-            magnitude = field['magnitude']
-            segments = [((x[i], y[i]), (x[i + 1], y[i + 1])) for i in range(len(x) - 1)]
-            colors = [cmap(norm(value)) for value in magnitude]  # Colormap for each segment
-            lc = LineCollection(segments, colors=colors, linewidths=0.5)
-            ax.add_collection(lc)
-            self.fieldlines_line_collection.append(lc)
-            if not self.fieldlines_show_status:
-                lc.set_visible(False)
 
-        self.canvas.draw()
+        if not coords:
+            return
+        # Transform and project the points of all lines at once
+        lengths = [len(coord) for coord in coords]
+        xyz = np.concatenate(coords)
+        b = {c: np.concatenate([field[c] for field in fields]) for c in ('bx', 'by', 'bz', 'magnitude')}
+        # Keep the plotted lines for later analysis, as flat per-point arrays plus the first point of each line
+        self.fieldlines_coords.append(dict(coords_hcc_xyz=xyz, line_starts=np.cumsum([0] + lengths[:-1]),
+                                           z_base=z_base, **b))
+        if self._hcc_to_hpc_rotation is None:
+            self._hcc_to_hpc_rotation = hcc_to_hpc_rotation(self.frame_hcc, self.frame_obs)
+        coord_hpc = hcc_to_hpc(xyz[:, 0] << u.Mm, xyz[:, 1] << u.Mm, (xyz[:, 2] + z_base) << u.Mm,
+                               self.frame_hcc, self.frame_obs, rotation=self._hcc_to_hpc_rotation)
+        # ax.plot_coord(coord_hpc, '-', c='tab:blue', lw=0.3, alpha=0.5)
+        xpix, ypix = self.map_context.world_to_pixel(coord_hpc)
+        # Segments between consecutive points of each line, each colored by the field at its first point
+        segments, magnitude = fieldline_segments(xpix.value, ypix.value, b['bx'], b['by'], b['bz'], lengths)
+        # Same colors as cmap(Normalize(*_FIELDLINE_B_RANGE)(magnitude)), as a direct lookup in the colormap table
+        bmin, bmax = _FIELDLINE_B_RANGE
+        n_colors = len(_FIELDLINE_LUT)
+        bad = np.isnan(magnitude)
+        idx = np.clip((np.where(bad, bmin, magnitude) - bmin) * (n_colors / (bmax - bmin)), 0, n_colors - 1)
+        colors = _FIELDLINE_LUT[idx.astype(np.intp)]
+        colors[bad] = _FIELDLINE_CMAP.get_bad()
+
+        # One collection for all the lines of this call keeps the artist count independent of the line count
+        lc = LineCollection(segments, colors=colors, linewidths=0.5)
+        ax.add_collection(lc)
+        self.fieldlines_line_collection.append(lc)
+        if not self.fieldlines_show_status:
+            lc.set_visible(False)
+
+        self._redraw_fieldlines()
 
     def plot(self):
         """
@@ -941,6 +1172,15 @@ class GxBox(QMainWindow):
         # The rest of the code for visualization goes here
         pass
 
+    def closeEvent(self, event):
+        """
+        Releases the cached HMI pixel geometry when the window closes.
+
+        :param event: QCloseEvent, The close event.
+        """
+        _b2ptr_geometry.cache_clear()
+        super().closeEvent(event)
+
 
 def main():
     """
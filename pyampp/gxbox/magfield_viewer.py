@@ -1,10 +1,10 @@
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QLabel, \
     QPushButton, QSlider, QLineEdit, QCheckBox, QMessageBox
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from astropy.time import Time
-from pyampp.gxbox.boxutils import validate_number
+from pyampp.gxbox.boxutils import validate_number, trace_streamlines
 
 import pyvista as pv
 from pyvistaqt import BackgroundPlotter
@@ -38,6 +38,104 @@ def maxval(max_val):
     return np.floor(max_val * 100) / 100
 
 
+def sphere_seed_points(center, radius, n_points, rng):
+    """
+    Draws points uniformly distributed within a sphere, as `vtkPointSource` does for streamline seeds.
+
+    :param center: tuple of float
+        The center of the sphere.
+    :param radius: float
+        The radius of the sphere.
+    :param n_points: int
+        The number of points to draw.
+    :param rng: numpy.random.Generator
+        The random number generator to draw from.
+    :return: numpy.ndarray
+        The (n_points, 3) array of points.
+    """
+    r, cos_theta, phi = rng.random((3, n_points))
+    r = radius * np.cbrt(r)
+    cos_theta = 1 - 2 * cos_theta
+    sin_theta = np.sqrt(1 - cos_theta ** 2)
+    phi = 2 * np.pi * phi
+    return np.asarray(center) + np.column_stack([r * sin_theta * np.cos(phi), r * sin_theta * np.sin(phi),
+                                                 r * cos_theta])
+
+
+def polylines(points, lengths):
+    """
+    Builds a PolyData of polylines from their concatenated points.
+
+    :param points: numpy.ndarray
+        The (N, 3) points of all lines, one line after the other.
+    :param lengths: numpy.ndarray
+        The number of points of each line.
+    :return: pyvista.PolyData
+        The lines.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    # VTK legacy cell layout: each line is its point count followed by its point ids
+    cells = np.empty(len(points) + len(lengths), dtype=np.int64)
+    count_at = np.cumsum(lengths + 1) - (lengths + 1)
+    is_id = np.ones(len(cells), dtype=bool)
+    is_id[count_at] = False
+    cells[count_at] = lengths
+    cells[is_id] = np.arange(len(points))
+    return pv.PolyData(points, lines=cells) if len(points) else pv.PolyData()
+
+
+def field_grid(bx, by, bz, dimensions, spacing, origin, dtype, cache=None):
+    """
+    Builds the ImageData holding a field for the viewer, reusing the one stored in `cache` if it was built from the
+    same cubes.
+
+    Reopening the viewer on the same box then skips the copy of the whole field into VTK arrays. The cubes are
+    compared by identity, so a model recomputed into new arrays gets a new grid.
+
+    :param bx: numpy.ndarray
+        The (nx, ny, nz) field x component.
+    :param by: numpy.ndarray
+        The field y component.
+    :param bz: numpy.ndarray
+        The field z component.
+    :param dimensions: tuple of int
+        The number of grid points along x, y and z.
+    :param spacing: tuple of float
+        The grid spacing along x, y and z.
+    :param origin: tuple of float
+        The position of the first grid point.
+    :param dtype: numpy.dtype
+        The dtype of the arrays handed to VTK.
+    :param cache: dict, optional
+        Holds the last grid built, with its source cubes and geometry; updated in place. No grid is kept if None.
+    :return: pyvista.ImageData
+        The grid, with the point arrays 'bx', 'by' and 'bz'.
+    """
+    geometry = (tuple(dimensions), tuple(spacing), tuple(origin), np.dtype(dtype))
+    if cache:
+        if all(a is b for a, b in zip(cache['sources'], (bx, by, bz))) and cache['geometry'] == geometry:
+            return cache['grid']
+
+    # One buffer holds the three components one after the other, each contiguous, so VTK takes the rows as the
+    # point arrays without copying them. VTK point order runs x fastest (Fortran order of the (nx, ny, nz) cubes),
+    # so each row, viewed as (nz, ny, nx), takes its component as the transposed cube in a single copy.
+    components = np.empty((3, bx.size), dtype=dtype)
+    components_zyx = components.reshape((3,) + bx.shape[::-1])
+    for i, b in enumerate((bx, by, bz)):
+        components_zyx[i] = b.T
+
+    grid = pv.ImageData()
+    grid.dimensions = dimensions
+    grid.spacing = spacing
+    grid.origin = origin
+    # No interleaved vector array: the slice and the streamline tracer read the components, and a 3-component VTK
+    # array would need a second, interleaved copy of the whole field
+    grid['bx'] = components[0]
+    grid['by'] = components[1]
+    grid['bz'] = components[2]
+    if cache is not None:
+        cache.update(sources=(bx, by, bz), geometry=geometry, grid=grid)
+    return grid
 
 
 class MagFieldViewer(BackgroundPlotter):
@@ -50,21 +148,37 @@ class MagFieldViewer(BackgroundPlotter):
         The parent object (default is None).
     """
 
+    # Precision of the field arrays handed to VTK; slicing and streamline tracing do not need double precision, and
+    # single precision halves the memory every grid traversal touches
+    field_dtype = np.float32
+    # Parameters the bottom slice and the streamlines depend on
+    slice_params = frozenset(('slice_z', 'scalar', 'vmin', 'vmax'))
+    streamline_params = frozenset(('center_x', 'center_y', 'center_z', 'radius', 'n_points'))
+
     def __init__(self, box, parent=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.box = box
         self.parent = parent
         self.updating = False  # Flag to avoid recursion
+        # Bursts of parameter changes (typing, dragging the sphere) are coalesced into one update shortly after the last
+        self.update_timer = QTimer()
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(50)
+        self.update_timer.timeout.connect(self._do_update_plot)
         self.sphere_actor = None
         self.plane_actor = None
         self.bottom_slice_actor = None
+        self.bottom_slice = None  # Horizontal slice of the grid shown by bottom_slice_actor, and its height
+        self.bottom_slice_z = None
         self.streamlines_actor = None
         self.streamlines = None
+        self.seed_rng = np.random.default_rng()  # Source of the streamline seed points
         self.sphere_visible = True
         self.plane_visible = True
         self.scalar = 'bz'
         self.previous_params = {}
         self.previous_valid_values = {}
+        self.validated_inputs = {}  # Last accepted (text, bounds) of each input widget and the value it gave
         self.scalar_selector = None
         self.center_x_input = None
         self.center_y_input = None
@@ -77,15 +191,22 @@ class MagFieldViewer(BackgroundPlotter):
         self.update_button = None
         self.send_button = None
         self.sphere_checkbox = None
-        self.grid_x = self.box.grid_coords['x'].value
-        self.grid_y = self.box.grid_coords['y'].value
-        self.grid_z = self.box.grid_coords['z'].value
+        grid_coords = self.box.grid_coords
+        self.grid_x = grid_coords['x']
+        self.grid_y = grid_coords['y']
+        self.grid_z = grid_coords['z']
         self.grid_xmin, self.grid_xmax = minval(self.grid_x.min()), maxval(self.grid_x.max())
         self.grid_ymin, self.grid_ymax = minval(self.grid_y.min()), maxval(self.grid_y.max())
-        self.grid_zmin, self.grid_zmax = minval(self.grid_z.min()), maxval(self.grid_z.max())
-        self.grid_zbase = self.grid_zmin
+        zmin, zmax = self.grid_z.min(), self.grid_z.max()
+        self.grid_zbase = minval(zmin)
+        # Shift to the base height; the shared axis of the box is not modified in place, and subtracting is
+        # monotonic, so the shifted extremes follow from the ones just computed
         self.grid_z = self.grid_z - self.grid_zbase
-        self.grid_zmin, self.grid_zmax = self.grid_z.min(), self.grid_z.max()
+        self.grid_zmin, self.grid_zmax = zmin - self.grid_zbase, zmax - self.grid_zbase
+        # Extents of the grid axes, looked up by the input validation on every update
+        self.grid_xptp, self.grid_yptp, self.grid_zptp = (float(np.ptp(c))
+                                                          for c in (self.grid_x, self.grid_y, self.grid_z))
+        self.grid_ptp_min = min(self.grid_xptp, self.grid_yptp, self.grid_zptp)
 
         # self.init_ui()
         self.add_widgets_to_window()
@@ -174,7 +295,7 @@ class MagFieldViewer(BackgroundPlotter):
             f"Enter the X, Y, and Z coordinates for the center of the sphere.")
         self.center_x_input = QLineEdit(f"{np.mean(self.grid_x):.2f}")
         self.center_y_input = QLineEdit(f"{np.mean(self.grid_y):.2f}")
-        self.center_z_input = QLineEdit(f"{self.grid_zmin + self.grid_z.ptp() * 0.1:.2f}")
+        self.center_z_input = QLineEdit(f"{self.grid_zmin + self.grid_zptp * 0.1:.2f}")
         self.center_x_input.setToolTip(
             f"Enter the X coordinate for the center of the sphere in the range of {self.grid_xmin:.2f} to {self.grid_xmax:.2f} Mm.")
         self.center_y_input.setToolTip(
@@ -193,7 +314,7 @@ class MagFieldViewer(BackgroundPlotter):
         radius_label.setToolTip(
             f"Enter the radius of the sphere.")
         self.radius_input = QLineEdit(
-            f"{min(self.grid_x.ptp(), self.grid_y.ptp(), self.grid_z.ptp()) * 0.05:.2f}")
+            f"{self.grid_ptp_min * 0.05:.2f}")
         self.radius_input.setToolTip(
             f"Enter the radius of the sphere in Mm.")
         self.radius_input.returnPressed.connect(lambda: self.on_radius_input_returnPressed(self.radius_input))
@@ -358,38 +479,46 @@ class MagFieldViewer(BackgroundPlotter):
         :return: float
             The valid value.
         '''
-        try:
-            value = float(widget.text())
-            if not min_val <= value <= max_val:
-                original_value = min_val if value < min_val else max_val
-                raise ValueError
+        text = widget.text()
+        key = (text, min_val, max_val, to_int)
+        if paired_widget is None and self.validated_inputs.get(widget, (None,))[0] == key:
+            # Unchanged text against unchanged bounds validates to the same value
+            return self.validated_inputs[widget][1]
 
-            if paired_widget:
-                paired_value = float(paired_widget.text())
-                if paired_type == 'vmin' and value >= paired_value:
-                    raise ValueError
-                if paired_type == 'vmax' and value <= paired_value:
-                    raise ValueError
-
-            if to_int:
-                value = int(value)
-
-            self.previous_valid_values[widget] = value
-            return value
+        try:
+            value = float(text)
         except ValueError:
-            # if paired_type == 'vmin':
-            #     QMessageBox.warning(self, "Invalid Input",
-            #                         f"Please enter a number between {min_val:.3f} and {max_val:.3f} that is less than the corresponding max value.")
-            # elif paired_type == 'vmax':
-            #     QMessageBox.warning(self, "Invalid Input",
-            #                         f"Please enter a number between {min_val:.3f} and {max_val:.3f} that is greater than the corresponding min value.")
-            # else:
-            #     QMessageBox.warning(self, "Invalid Input",
-            #                         f"Please enter a number between {min_val:.3f} and {max_val:.3f}. Revert to the original value.")
-
             widget.setText(str(original_value))
             return original_value
 
+        if not min_val <= value <= max_val:
+            value = min_val if value < min_val else max_val
+            widget.setText(str(value))
+            return value
+
+        if paired_widget:
+            try:
+                paired_value = float(paired_widget.text())
+            except ValueError:
+                paired_value = None
+            if paired_value is None or (paired_type == 'vmin' and value >= paired_value) or \
+                    (paired_type == 'vmax' and value <= paired_value):
+                # if paired_type == 'vmin':
+                #     QMessageBox.warning(self, "Invalid Input",
+                #                         f"Please enter a number between {min_val:.3f} and {max_val:.3f} that is less than the corresponding max value.")
+                # elif paired_type == 'vmax':
+                #     QMessageBox.warning(self, "Invalid Input",
+                #                         f"Please enter a number between {min_val:.3f} and {max_val:.3f} that is greater than the corresponding min value.")
+                widget.setText(str(original_value))
+                return original_value
+
+        if to_int:
+            value = int(value)
+
+        self.previous_valid_values[widget] = value
+        self.validated_inputs[widget] = (key, value)
+        return value
+
     def show_plot(self):
         """
         Initializes and displays the plot with the magnetic field data.
@@ -398,19 +527,10 @@ class MagFieldViewer(BackgroundPlotter):
         y = self.grid_y
         z = self.grid_z
 
-        bx = self.box.b3d['nlfff']['bx']
-        by = self.box.b3d['nlfff']['by']
-        bz = self.box.b3d['nlfff']['bz']
-        vectors = np.c_[bx.ravel(order='F'), by.ravel(order='F'), bz.ravel(order='F')]
-
-        self.grid = pv.ImageData()
-        self.grid.dimensions = (len(x), len(y), len(z))
-        self.grid.spacing = (x[1] - x[0], y[1] - y[0], z[1] - z[0])
-        self.grid.origin = (x.min(), y.min(), z.min())
-        self.grid['vectors'] = vectors
-        self.grid['bx'] = bx.ravel(order='F')
-        self.grid['by'] = by.ravel(order='F')
-        self.grid['bz'] = bz.ravel(order='F')
+        nlfff = self.box.b3d.nlfff
+        self.grid = field_grid(nlfff['bx'], nlfff['by'], nlfff['bz'], (len(x), len(y), len(z)),
+                               (x[1] - x[0], y[1] - y[0], z[1] - z[0]), (x.min(), y.min(), z.min()), self.field_dtype,
+                               cache=self.box.viewer_grid_cache)
 
         self.previous_valid_values = {
             self.center_x_input: float(self.center_x_input.text()),
@@ -423,9 +543,20 @@ class MagFieldViewer(BackgroundPlotter):
             self.vmax_input: float(self.vmax_input.text())
         }
 
-        self.update_plot()
+        self._do_update_plot()
 
     def update_plot(self):
+        """
+        Schedules an update of the plot from the current input parameters.
+
+        Calls arriving before the update runs restart the timer, so a burst of changes triggers a single update, and
+        with it at most one streamline integration.
+        """
+        if self.updating:  # Check if already updating
+            return
+        self.update_timer.start()
+
+    def _do_update_plot(self):
         """
         Updates the plot based on the current input parameters.
         """
@@ -441,7 +572,7 @@ class MagFieldViewer(BackgroundPlotter):
                                        self.previous_valid_values[self.center_y_input])
         center_z = self.validate_input(self.center_z_input, 0, self.grid_zmax,
                                        self.previous_valid_values[self.center_z_input])
-        radius = self.validate_input(self.radius_input, 0, min(self.grid_x.ptp(), self.grid_y.ptp(), self.grid_z.ptp()),
+        radius = self.validate_input(self.radius_input, 0, self.grid_ptp_min,
                                      self.previous_valid_values[self.radius_input])
         n_points = self.validate_input(self.n_points_input, 1, 1000, self.previous_valid_values[self.n_points_input],
                                        to_int=True)
@@ -473,33 +604,27 @@ class MagFieldViewer(BackgroundPlotter):
             "plane_visible": plane_visible
         }
 
-        # Check if parameters have changed
-        if current_params == self.previous_params:
+        # Check which parameters have changed, in one pass over them
+        changed = {key for key, value in current_params.items() if value != self.previous_params.get(key)}
+        if not changed:
             self.updating = False  # Reset the flag
             return
 
         # Update only relevant objects based on parameter changes
-        if current_params['slice_z'] != self.previous_params.get('slice_z') or \
-                current_params['scalar'] != self.previous_params.get('scalar') or \
-                current_params['vmin'] != self.previous_params.get('vmin') or \
-                current_params['vmax'] != self.previous_params.get('vmax'):
+        if changed & self.slice_params:
             print(current_params['slice_z'], current_params['scalar'], current_params['vmin'],
                   current_params['vmax'])
             self.update_slice(current_params['slice_z'], current_params['scalar'], current_params['vmin'],
                               current_params['vmax'])
 
-        if current_params['center_x'] != self.previous_params.get('center_x') or \
-                current_params['center_y'] != self.previous_params.get('center_y') or \
-                current_params['center_z'] != self.previous_params.get('center_z') or \
-                current_params['radius'] != self.previous_params.get('radius') or \
-                current_params['n_points'] != self.previous_params.get('n_points'):
+        if changed & self.streamline_params:
             self.update_streamlines(current_params['center_x'], current_params['center_y'], current_params['center_z'],
                                     current_params['radius'], current_params['n_points'])
 
-        if current_params['sphere_visible'] != self.previous_params.get('sphere_visible'):
+        if 'sphere_visible' in changed:
             self.update_sphere_visibility(current_params['sphere_visible'])
 
-        if current_params['plane_visible'] != self.previous_params.get('plane_visible'):
+        if 'plane_visible' in changed:
             self.update_plane_visibility(current_params['plane_visible'])
 
         # Update previous parameters
@@ -522,15 +647,46 @@ class MagFieldViewer(BackgroundPlotter):
         :param vmax: float
             The maximum value for the color scale.
         """
-        new_slice = self.grid.slice(normal='z', origin=(self.grid.origin[0], self.grid.origin[1], slice_z))
         if self.bottom_slice_actor is None:
-            self.bottom_slice_actor = self.add_mesh(new_slice, scalars=scalar, clim=(vmin, vmax), show_edges=False,
-                                                    cmap='gray', pickable=False, show_scalar_bar=False)
-        else:
-            self.remove_actor(self.bottom_slice_actor)
-            self.bottom_slice_actor = self.add_mesh(new_slice, scalars=scalar, clim=(vmin, vmax), show_edges=False,
-                                                    cmap='gray', pickable=False, reset_camera=False,
+            nx, ny, _ = self.grid.dimensions
+            self.bottom_slice = pv.ImageData(dimensions=(nx, ny, 1), spacing=self.grid.spacing,
+                                             origin=self.grid.origin)
+            for name in ('bx', 'by', 'bz'):
+                self.bottom_slice[name] = np.empty(nx * ny, dtype=self.grid[name].dtype)
+            self.fill_bottom_slice(slice_z)
+            self.bottom_slice_actor = self.add_mesh(self.bottom_slice, scalars=scalar, clim=(vmin, vmax),
+                                                    show_edges=False, cmap='gray', pickable=False,
                                                     show_scalar_bar=False)
+            return
+
+        # The slice mesh and actor are kept; a new height only refills the slice, a new scalar or color range only
+        # recolors the actor
+        if slice_z != self.bottom_slice_z:
+            self.fill_bottom_slice(slice_z)
+        mapper = self.bottom_slice_actor.mapper
+        mapper.SetScalarModeToUsePointFieldData()
+        mapper.SelectColorArray(scalar)
+        mapper.scalar_range = (vmin, vmax)
+        self.render()
+
+    def fill_bottom_slice(self, slice_z):
+        """
+        Moves the bottom slice to the given height and fills it with the field interpolated between the two
+        neighbouring grid layers, which is what cutting the grid with a horizontal plane yields.
+
+        :param slice_z: float
+            The Z coordinate for the slice.
+        """
+        nx, ny, nz = self.grid.dimensions
+        oz, dz = self.grid.origin[2], self.grid.spacing[2]
+        t = (slice_z - oz) / dz
+        k = int(min(max(np.floor(t), 0), nz - 2))
+        w = min(max(t - k, 0.), 1.)
+        for name in ('bx', 'by', 'bz'):
+            b = self.grid[name].reshape(nz, ny, nx)
+            self.bottom_slice[name][:] = ((1 - w) * b[k] + w * b[k + 1]).ravel()
+        self.bottom_slice.origin = (self.grid.origin[0], self.grid.origin[1], slice_z)
+        self.bottom_slice_z = slice_z
 
     def update_streamlines(self, center_x, center_y, center_z, radius, n_points):
         """
@@ -547,17 +703,28 @@ class MagFieldViewer(BackgroundPlotter):
         :param n_points: int
             The number of seed points for the streamlines.
         """
-        self.streamlines = self.grid.streamlines(vectors='vectors', source_center=(center_x, center_y, center_z),
-                                                 source_radius=radius, n_points=n_points, integration_direction='both',
-                                                 max_time=5000, progress_bar=False)
+        # Seeds are drawn directly in numpy rather than through a vtkPointSource pipeline built on every call
+        seeds = sphere_seed_points((center_x, center_y, center_z), radius, n_points, self.seed_rng)
+        nx, ny, nz = self.grid.dimensions
+        # The lines are traced in parallel over the seeds with a compiled RK4 integrator on the uniform grid, one
+        # cell per step, instead of the single-threaded vtkStreamTracer
+        points, field, lengths = trace_streamlines(*(self.grid[c].reshape(nz, ny, nx) for c in ('bx', 'by', 'bz')),
+                                                   self.grid.origin, self.grid.spacing, seeds,
+                                                   step=min(self.grid.spacing), max_length=5000)
+        self.streamlines = polylines(points, lengths)
         if self.streamlines.n_points > 0:
+            self.streamlines['vectors'] = field
+            for i, c in enumerate(('bx', 'by', 'bz')):
+                self.streamlines[c] = field[:, i]
+            # The tube mesh grows with the number of sides times the number of segments; dense seedings get coarser
+            # tubes, which at radius 0.1 are hard to tell apart from round ones
+            tubes = self.streamlines.tube(radius=0.1, n_sides=6 if n_points > 50 else 20)
             if self.streamlines_actor is None:
-                self.streamlines_actor = self.add_mesh(self.streamlines.tube(radius=0.1), pickable=False,
-                                                       show_scalar_bar=False)
+                self.streamlines_actor = self.add_mesh(tubes, pickable=False, show_scalar_bar=False)
             else:
                 self.remove_actor(self.streamlines_actor)
-                self.streamlines_actor = self.add_mesh(self.streamlines.tube(radius=0.1), pickable=False,
-                                                       reset_camera=False, show_scalar_bar=False)
+                self.streamlines_actor = self.add_mesh(tubes, pickable=False, reset_camera=False,
+                                                       show_scalar_bar=False)
         else:
             print("No streamlines generated.")
 
@@ -621,7 +788,7 @@ class MagFieldViewer(BackgroundPlotter):
         Updates the plane widget based on the current input parameters.
         """
         if self.plane_actor is not None:
-            origin = self.grid_x.ptp() / 2, self.grid_y.ptp() / 2
+            origin = self.grid_xptp / 2, self.grid_yptp / 2
             slice_z = float(self.slice_z_input.text())
             self.plane_actor.SetOrigin([origin[0], origin[1], slice_z])
             self.update_plot()
@@ -635,7 +802,7 @@ class MagFieldViewer(BackgroundPlotter):
         """
         if plane_visible:
             if self.plane_actor is None:
-                origin = self.grid_x.ptp() / 2, self.grid_y.ptp() / 2
+                origin = self.grid_xptp / 2, self.grid_yptp / 2
                 slice_z = float(self.slice_z_input.text())
                 self.plane_actor = self.add_plane_widget(self.on_plane_moved, normal='z',
                                                          origin=(origin[0], origin[1], slice_z), bounds=(
@@ -673,6 +840,10 @@ class MagFieldViewer(BackgroundPlotter):
         """
         Sends the streamline data to the parent object (if any).
         """
+        if self.update_timer.isActive():
+            # Send the streamlines of the latest parameters, not those of the update still pending
+            self.update_timer.stop()
+            self._do_update_plot()
         print(f"Sending streamlines to {self.parent}")
         if self.parent is not None and self.streamlines_actor is not None:
             if self.streamlines.n_lines > 0:
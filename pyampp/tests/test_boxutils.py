@@ -0,0 +1,320 @@
+import astropy.units as u
+import h5py
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
+from astropy.time import Time
+from sunpy.coordinates import Heliocentric, HeliographicStonyhurst, Helioprojective, get_earth
+from sunpy.map import Map, all_coordinates_from_map, make_fitswcs_header
+
+from pyampp.gxbox.boxutils import fieldline_segments, hcc_to_hpc, hcc_to_hpc_rotation, hmi_b2ptr, hmi_disambig, \
+    read_b3d_h5, trace_streamlines, write_b3d_h5, _b2ptr_geometry, _hpc_to_hgs_kernel, _trace_streamlines_kernel
+
+
+def _synthetic_hmi_maps(shape=(48, 52), scale=50., rotation=3.):
+    """
+    Random field, inclination and azimuth maps covering the whole disk, for an Earth observer with a non-zero B0.
+    """
+    obstime = Time('2024-09-07T12:00:00')
+    observer = get_earth(obstime)
+    center = SkyCoord(0 * u.arcsec, 0 * u.arcsec, frame=Helioprojective(obstime=obstime, observer=observer))
+    header = make_fitswcs_header(shape, center, scale=[scale, scale] * u.arcsec / u.pix,
+                                 rotation_angle=rotation * u.deg)
+    header['crota2'] = rotation
+    header['crlt_obs'] = observer.lat.to_value(u.deg)
+    rng = np.random.default_rng(2)
+    field = Map(rng.uniform(0., 2000., shape).astype(np.float32), header)
+    inclination = Map(rng.uniform(0., 180., shape).astype(np.float32), header)
+    azimuth = Map(rng.uniform(0., 360., shape).astype(np.float32), header)
+    return field, inclination, azimuth
+
+
+def _observer_hgs(smap):
+    return smap.observer_coordinate.transform_to(HeliographicStonyhurst(obstime=smap.date))
+
+
+def test_hpc_to_hgs_kernel_matches_sunpy():
+    smap = _synthetic_hmi_maps()[0]
+    ref = all_coordinates_from_map(smap).transform_to(HeliographicStonyhurst(obstime=smap.date))
+    observer = _observer_hgs(smap)
+    hpc = all_coordinates_from_map(smap)
+    tx = np.ascontiguousarray(hpc.Tx.to_value(u.deg).ravel())
+    ty = np.ascontiguousarray(hpc.Ty.to_value(u.deg).ravel())
+    lon = np.empty(tx.size, dtype=np.float32)
+    lat = np.empty(tx.size, dtype=np.float32)
+    _hpc_to_hgs_kernel(tx, ty, observer.radius.to_value(u.m), smap.rsun_meters.to_value(u.m),
+                       observer.lat.to_value(u.rad), observer.lon.to_value(u.rad), lon, lat)
+    ref_lon = ref.lon.wrap_at(180 * u.deg).to_value(u.deg).ravel()
+    ref_lat = ref.lat.to_value(u.deg).ravel()
+    # Same off-limb mask, and angles equal to float32 precision
+    on_disk = np.isfinite(ref_lon)
+    assert 0 < on_disk.sum() < on_disk.size
+    np.testing.assert_array_equal(np.isfinite(lon), on_disk)
+    np.testing.assert_allclose(np.rad2deg(lon[on_disk]), ref_lon[on_disk], atol=1e-5)
+    np.testing.assert_allclose(np.rad2deg(lat[on_disk]), ref_lat[on_disk], atol=1e-5)
+
+    # _b2ptr_geometry keeps exactly the on-disk pixels
+    index = _b2ptr_geometry(smap.wcs.to_header_string(), *smap.data.shape, observer.radius.to_value(u.m),
+                            smap.rsun_meters.to_value(u.m), observer.lat.to_value(u.rad),
+                            observer.lon.to_value(u.rad))[0]
+    np.testing.assert_array_equal(index, np.flatnonzero(on_disk))
+
+
+def _hmi_b2ptr_reference(map_field, map_inclination, map_azimuth):
+    """
+    The original NumPy implementation of hmi_b2ptr, on sunpy's per-pixel coordinate transform.
+    """
+    field = map_field.data.astype(np.float64)
+    gamma = np.deg2rad(map_inclination.data.astype(np.float64))
+    psi = np.deg2rad(map_azimuth.data.astype(np.float64))
+
+    b_xi = -field * np.sin(gamma) * np.sin(psi)
+    b_eta = field * np.sin(gamma) * np.cos(psi)
+    b_zeta = field * np.cos(gamma)
+
+    foo = all_coordinates_from_map(map_field).transform_to(HeliographicStonyhurst)
+    phi = foo.lon.to_value(u.rad)
+    lambda_ = foo.lat.to_value(u.rad)
+
+    b = np.deg2rad(map_field.fits_header["crlt_obs"])
+    p = np.deg2rad(-map_field.fits_header["crota2"])
+
+    sinb, cosb = np.sin(b), np.cos(b)
+    sinp, cosp = np.sin(p), np.cos(p)
+    sinphi, cosphi = np.sin(phi), np.cos(phi)
+    sinlam, coslam = np.sin(lambda_), np.cos(lambda_)
+
+    k11 = coslam * (sinb * sinp * cosphi + cosp * sinphi) - sinlam * cosb * sinp
+    k12 = - coslam * (sinb * cosp * cosphi - sinp * sinphi) + sinlam * cosb * cosp
+    k13 = coslam * cosb * cosphi + sinlam * sinb
+    k21 = sinlam * (sinb * sinp * cosphi + cosp * sinphi) + coslam * cosb * sinp
+    k22 = - sinlam * (sinb * cosp * cosphi - sinp * sinphi) - coslam * cosb * cosp
+    k23 = sinlam * cosb * cosphi - coslam * sinb
+    k31 = - sinb * sinp * sinphi + cosp * cosphi
+    k32 = sinb * cosp * sinphi + sinp * cosphi
+    k33 = - cosb * sinphi
+
+    bp = k31 * b_xi + k32 * b_eta + k33 * b_zeta
+    bt = k21 * b_xi + k22 * b_eta + k23 * b_zeta
+    br = k11 * b_xi + k12 * b_eta + k13 * b_zeta
+    return bp, bt, br
+
+
+def test_hmi_b2ptr_matches_reference():
+    maps = _synthetic_hmi_maps()
+    ref = _hmi_b2ptr_reference(*maps)
+    for result, expected in zip(hmi_b2ptr(*maps), ref):
+        assert result.data.dtype == np.float32
+        np.testing.assert_array_equal(np.isfinite(result.data), np.isfinite(expected))
+        on_disk = np.isfinite(expected)
+        # Single precision on fields of up to 2000 G
+        np.testing.assert_allclose(result.data[on_disk], expected[on_disk], atol=5e-3)
+
+
+def test_hmi_disambig_matches_bit_flip():
+    azimuth_map = _synthetic_hmi_maps()[2]
+    # HMI segments are read as big-endian float32 azimuth and int16 disambiguation flags
+    azimuth = azimuth_map.data.astype('>f4')
+    flags = np.random.default_rng(5).integers(0, 8, azimuth.shape).astype('>i2')
+    azimuth_in = Map(azimuth, azimuth_map.meta)
+    for method in range(3):
+        result = hmi_disambig(azimuth_in, Map(flags, azimuth_map.meta), method=method)
+        expected = (azimuth.astype(np.float64) + 180. * ((flags >> method) & 1)) % 360.
+        assert result.data.dtype == np.float32
+        np.testing.assert_allclose(result.data, expected, atol=1e-4)
+    np.testing.assert_array_equal(azimuth_in.data, azimuth)
+
+
+@pytest.mark.parametrize('dt', [0., 1.])
+def test_hcc_to_hpc_matches_skycoord_transform(dt):
+    obstime = Time('2024-05-09T17:12:00')
+    box_center = SkyCoord(20 * u.deg, -15 * u.deg, frame=HeliographicStonyhurst(obstime=obstime))
+    frame_hcc = Heliocentric(observer=box_center, obstime=obstime)
+    # With different obstimes the Sun's center moves between the two frames
+    frame_obs = Helioprojective(observer=get_earth(obstime + dt * u.h), obstime=obstime + dt * u.h)
+    rng = np.random.default_rng(3)
+    x, y = rng.uniform(-50., 50., (2, 4, 25)) << u.Mm
+    z = rng.uniform(696., 800., (4, 25)) << u.Mm
+    ref = SkyCoord(x=x, y=y, z=z, frame=frame_hcc).transform_to(frame_obs)
+    for rotation in (None, hcc_to_hpc_rotation(frame_hcc, frame_obs)):
+        result = hcc_to_hpc(x, y, z, frame_hcc, frame_obs, rotation=rotation)
+        assert result.shape == ref.shape
+        np.testing.assert_allclose(result.Tx.to_value(u.arcsec), ref.Tx.to_value(u.arcsec), rtol=0, atol=1e-8)
+        np.testing.assert_allclose(result.Ty.to_value(u.arcsec), ref.Ty.to_value(u.arcsec), rtol=0, atol=1e-8)
+        np.testing.assert_allclose(result.distance.to_value(u.m), ref.distance.to_value(u.m), rtol=1e-12)
+
+
+def test_fieldline_segments_matches_per_line_loop():
+    lengths = [5, 0, 1, 2, 7, 1]
+    rng = np.random.default_rng(4)
+    x, y, bx, by, bz = rng.normal(size=(5, sum(lengths)))
+    segments, magnitude = fieldline_segments(x, y, bx, by, bz, lengths)
+
+    expected_segments, expected_magnitude = [], []
+    start = 0
+    for n in lengths:
+        xy = np.column_stack([x[start:start + n], y[start:start + n]])
+        expected_segments.append(np.stack([xy[:-1], xy[1:]], axis=1).reshape(-1, 2, 2))
+        expected_magnitude.append(np.sqrt(bx ** 2 + by ** 2 + bz ** 2)[start:start + n][:-1])
+        start += n
+    np.testing.assert_array_equal(segments, np.concatenate(expected_segments))
+    np.testing.assert_allclose(magnitude, np.concatenate(expected_magnitude), rtol=1e-12)
+
+    segments, magnitude = fieldline_segments(x[:1], y[:1], bx[:1], by[:1], bz[:1], [1])
+    assert segments.shape == (0, 2, 2) and magnitude.shape == (0,)
+    segments, magnitude = fieldline_segments([], [], [], [], [], [])
+    assert segments.shape == (0, 2, 2) and magnitude.shape == (0,)
+
+
+def _uniform_grid(nx, ny, nz, spacing, origin):
+    """
+    Point coordinates of a uniform grid as (nz, ny, nx) cubes, x varying fastest.
+    """
+    z, y, x = np.meshgrid(*(o + s * np.arange(n) for o, s, n in zip(origin[::-1], spacing[::-1], (nz, ny, nx))),
+                          indexing='ij')
+    return x, y, z
+
+
+def test_trace_streamlines_circular_field():
+    origin, spacing = (-10., -10., 0.), (.5, .5, .5)
+    x, y, z = _uniform_grid(41, 41, 5, spacing, origin)
+    # B = (-y, x, 0): the field lines are circles around the z axis
+    points, field, lengths = trace_streamlines(-y, x, np.zeros_like(x), origin, spacing, [(3., 0., 1.)], step=.1,
+                                               max_length=2 * np.pi * 3)
+    assert len(lengths) == 1 and lengths[0] == len(points) > 100
+    np.testing.assert_allclose(np.hypot(points[:, 0], points[:, 1]), 3., atol=1e-4)
+    np.testing.assert_allclose(points[:, 2], 1.)
+    np.testing.assert_allclose(field[:, :2], np.stack([-points[:, 1], points[:, 0]], axis=1), atol=1e-9)
+
+
+def test_trace_streamlines_stops_at_boundary():
+    origin, spacing = (0., 0., 0.), (1., 1., 1.)
+    shape = (5, 6, 11)
+    step = .5
+    points, field, lengths = trace_streamlines(np.ones(shape), np.zeros(shape), np.zeros(shape), origin, spacing,
+                                               [(5.25, 2., 3.)], step=step)
+    assert len(lengths) == 1
+    # The line runs along x through the whole grid and ends within one step of either face
+    assert 0. <= points[:, 0].min() < step
+    assert 10. - step < points[:, 0].max() <= 10.
+    assert np.all(np.diff(points[:, 0]) > 0)
+    np.testing.assert_allclose(points[:, 1:], [[2., 3.]] * len(points))
+    np.testing.assert_allclose(field, [[1., 0., 0.]] * len(points))
+
+
+def test_trace_streamlines_drops_seeds_outside_grid_and_on_nulls():
+    origin, spacing = (0., 0., 0.), (1., 1., 1.)
+    shape = (5, 6, 11)
+    bx = np.ones(shape)
+    bx[:, :, :3] = 0.
+    seeds = [(5., 2., 2.), (-1., 2., 2.), (5., 2., 20.), (1., 2., 2.), (7., 3., 1.)]
+    points, field, lengths = trace_streamlines(bx, np.zeros(shape), np.zeros(shape), origin, spacing, seeds,
+                                               step=.5)
+    # The seeds outside the grid and the one in the null region give no line
+    assert len(lengths) == 2
+    assert lengths.sum() == len(points) == len(field)
+
+
+def test_trace_streamlines_count_and_fill_passes_agree():
+    origin, spacing = (-10., -10., 0.), (.5, .5, .5)
+    x, y, z = _uniform_grid(41, 41, 9, spacing, origin)
+    bx, by, bz = -y, x, np.full_like(x, .3)
+    rng = np.random.default_rng(0)
+    seeds = rng.uniform((-12., -12., -1.), (12., 12., 5.), size=(50, 3))
+    step, max_steps = .2, 500
+    origin, spacing = np.asarray(origin), np.asarray(spacing)
+    n_back = np.empty(len(seeds), dtype=np.int64)
+    n_forward = np.empty(len(seeds), dtype=np.int64)
+    no_points = np.empty((0, 3))
+    _trace_streamlines_kernel(bx, by, bz, origin, spacing, seeds, step, max_steps, np.zeros(1, dtype=np.int64),
+                              n_back, n_forward, no_points, no_points)
+    lengths = np.where(n_back >= 0, n_back + n_forward + 1, 0)
+    lengths[lengths == 1] = 0
+    n_back[lengths == 0] = 0
+    n_forward[lengths == 0] = 0
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    points = np.full((offsets[-1], 3), np.nan)
+    field = np.full((offsets[-1], 3), np.nan)
+    _trace_streamlines_kernel(bx, by, bz, origin, spacing, seeds, step, max_steps, offsets, n_back, n_forward,
+                              points, field)
+    # The fill pass writes every row the count pass reserved, with each seed at its counted position
+    assert np.isfinite(points).all() and np.isfinite(field).all()
+    traced = lengths > 0
+    np.testing.assert_array_equal(points[(offsets[:-1] + n_back)[traced]], seeds[traced])
+
+    points_ref, field_ref, lengths_ref = trace_streamlines(bx, by, bz, origin, spacing, seeds, step,
+                                                           max_steps=max_steps)
+    np.testing.assert_array_equal(lengths_ref, lengths[traced])
+    np.testing.assert_array_equal(points_ref, points)
+    np.testing.assert_array_equal(field_ref, field)
+
+
+def test_trace_streamlines_viewer_grid_layout():
+    pytest.importorskip('pyvistaqt')
+    from pyampp.gxbox.magfield_viewer import field_grid
+
+    nx, ny, nz = 7, 5, 4
+    spacing, origin = (1., .5, 2.), (-3., 1., 0.)
+    axes = [o + s * np.arange(n) for o, s, n in zip(origin, spacing, (nx, ny, nz))]
+    # (nx, ny, nz) cubes, as held by the box, of the point coordinates themselves
+    cubes = np.meshgrid(*axes, indexing='ij')
+    grid = field_grid(*cubes, (nx, ny, nz), spacing, origin, np.float64)
+    components = [grid[c].reshape(nz, ny, nx) for c in ('bx', 'by', 'bz')]
+    # Viewed as (nz, ny, nx), the grid arrays line up with VTK's x-fastest points
+    for i, component in enumerate(components):
+        np.testing.assert_array_equal(component, grid.points[:, i].reshape(nz, ny, nx))
+    rng = np.random.default_rng(1)
+    seeds = rng.uniform(np.min(grid.points, axis=0), np.max(grid.points, axis=0), size=(10, 3))
+    points, field, lengths = trace_streamlines(*components, grid.origin, grid.spacing, seeds, step=.1, max_steps=20)
+    # B = r is linear, so the interpolated field equals the position wherever the grid layout is right
+    assert len(lengths) == len(seeds)
+    np.testing.assert_allclose(field, points, atol=1e-9)
+
+
+def _random_cubes(shape=(6, 5, 4), dtype=np.float64, seed=5):
+    rng = np.random.default_rng(seed)
+    return {c: rng.normal(size=shape).astype(dtype) for c in ('bx', 'by', 'bz')}
+
+
+def test_b3d_h5_round_trip_keeps_dtype(tmp_path):
+    filename = tmp_path / 'box.h5'
+    cubes = _random_cubes()
+    write_b3d_h5(filename, {'nlfff': cubes, 'lfff': None}, dtype=None)
+    b3d = read_b3d_h5(filename)
+    # Model types set to None are not written
+    assert list(b3d) == ['nlfff']
+    for c, cube in cubes.items():
+        assert b3d['nlfff'][c].dtype == np.float64
+        np.testing.assert_array_equal(b3d['nlfff'][c], cube)
+
+
+def test_b3d_h5_round_trip_float32_default(tmp_path):
+    filename = tmp_path / 'box.h5'
+    cubes = _random_cubes()
+    write_b3d_h5(filename, {'lfff': cubes})
+    b3d = read_b3d_h5(filename)
+    for c, cube in cubes.items():
+        assert b3d['lfff'][c].dtype == np.float32
+        np.testing.assert_array_equal(b3d['lfff'][c], cube.astype(np.float32))
+
+
+def test_b3d_h5_float32_default_keeps_integer_arrays(tmp_path):
+    filename = tmp_path / 'box.h5'
+    cubes = _random_cubes()
+    mask = np.arange(cubes['bx'].size, dtype=np.int64).reshape(cubes['bx'].shape) + 2 ** 40
+    write_b3d_h5(filename, {'nlfff': dict(cubes, mask=mask)})
+    b3d = read_b3d_h5(filename)['nlfff']
+    assert b3d['bx'].dtype == np.float32
+    assert b3d['mask'].dtype == np.int64
+    np.testing.assert_array_equal(b3d['mask'], mask)
+
+
+def test_b3d_h5_stores_non_array_entries_as_attributes(tmp_path):
+    filename = tmp_path / 'box.h5'
+    components = dict(_random_cubes(), alpha=0.25, n_iter=np.int64(12), label='test')
+    write_b3d_h5(filename, {'nlfff': components})
+    with h5py.File(filename, 'r') as f:
+        assert set(f['nlfff'].keys()) == {'bx', 'by', 'bz'}
+        assert set(f['nlfff'].attrs.keys()) == {'alpha', 'n_iter', 'label'}
+    b3d = read_b3d_h5(filename)['nlfff']
+    assert b3d['alpha'] == 0.25 and b3d['n_iter'] == 12 and b3d['label'] == 'test'
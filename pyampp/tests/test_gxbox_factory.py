@@ -0,0 +1,102 @@
+import os
+import pickle
+
+import h5py
+import numpy as np
+
+from pyampp.gxbox.gxbox_factory import GxBox, _B3D
+
+
+class _Box:
+    def __init__(self):
+        self.b3dtype = list(_B3D.__slots__)
+        self.b3d = _B3D()
+
+
+class _Loader:
+    """
+    Stand-in for a GxBox, with just the box and the methods load_gxbox uses.
+    """
+    load_gxbox = GxBox.load_gxbox
+    _is_complete_b3d = GxBox._is_complete_b3d
+    _write_b3d_cache = GxBox._write_b3d_cache
+
+    def __init__(self):
+        self.box = _Box()
+
+
+def _write_pickled_box(path, b3d):
+    with open(path, 'wb') as f:
+        pickle.dump({'b3d': b3d}, f)
+
+
+def _cubes(seed=6):
+    rng = np.random.default_rng(seed)
+    return {c: rng.normal(size=(5, 6, 7)) for c in ('bx', 'by', 'bz')}
+
+
+def test_load_gxbox_converts_pickle_once(tmp_path):
+    boxfile = tmp_path / 'model.gxbox'
+    cubes = _cubes()
+    _write_pickled_box(boxfile, {'nlfff': dict(cubes, alpha=0.5), 'lfff': None})
+    loader = _Loader()
+    loader.load_gxbox(str(boxfile))
+    assert sorted(os.listdir(tmp_path)) == ['model.gxbox', 'model.gxbox.h5']
+    assert loader.box.b3d.lfff is None
+    np.testing.assert_array_equal(loader.box.b3d.nlfff['bx'], cubes['bx'])
+
+    # The second load reads the HDF5 cache, not the pickle
+    _write_pickled_box(boxfile, {'nlfff': _cubes(seed=7)})
+    os.utime(tmp_path / 'model.gxbox.h5', (os.path.getmtime(boxfile) + 1,) * 2)
+    loader = _Loader()
+    loader.load_gxbox(str(boxfile))
+    for c, cube in cubes.items():
+        assert loader.box.b3d.nlfff[c].dtype == np.float64
+        np.testing.assert_array_equal(loader.box.b3d.nlfff[c], cube)
+    assert loader.box.b3d.nlfff['alpha'] == 0.5
+
+
+def test_load_gxbox_ignores_stale_or_foreign_cache(tmp_path):
+    boxfile = tmp_path / 'model.gxbox'
+    h5file = tmp_path / 'model.gxbox.h5'
+    cubes = _cubes()
+    _write_pickled_box(boxfile, {'nlfff': cubes})
+
+    # A cache that cannot be read, or lacks the field components, is replaced from the pickle
+    for content in (b'not an hdf5 file', None):
+        if content is None:
+            with h5py.File(h5file, 'w') as f:
+                f.create_group('nlfff').create_dataset('bx', data=np.zeros(3))
+        else:
+            h5file.write_bytes(content)
+        os.utime(h5file, (os.path.getmtime(boxfile) + 1,) * 2)
+        loader = _Loader()
+        loader.load_gxbox(str(boxfile))
+        np.testing.assert_array_equal(loader.box.b3d.nlfff['bz'], cubes['bz'])
+
+    # A cache older than the pickle is not used
+    new_cubes = _cubes(seed=8)
+    _write_pickled_box(boxfile, {'nlfff': new_cubes})
+    os.utime(h5file, (os.path.getmtime(boxfile) - 10,) * 2)
+    loader = _Loader()
+    loader.load_gxbox(str(boxfile))
+    np.testing.assert_array_equal(loader.box.b3d.nlfff['bx'], new_cubes['bx'])
+
+
+def test_is_complete_b3d():
+    loader = _Loader()
+    components = {c: np.zeros(1) for c in ('bx', 'by', 'bz')}
+    assert loader._is_complete_b3d({'nlfff': components})
+    assert not loader._is_complete_b3d({})
+    assert not loader._is_complete_b3d({'nlfff': {'bx': np.zeros(1)}})
+    assert not loader._is_complete_b3d({'pot': components})
+
+
+def test_load_gxbox_leaves_no_partial_cache(tmp_path):
+    boxfile = tmp_path / 'model.gxbox'
+    # An object array cannot be stored in HDF5, so the conversion fails
+    _write_pickled_box(boxfile, {'nlfff': dict(_cubes(), extra=np.array([object()]))})
+    loader = _Loader()
+    loader.load_gxbox(str(boxfile))
+    assert os.listdir(tmp_path) == ['model.gxbox']
+    assert loader.box.b3d.nlfff['extra'].dtype == object
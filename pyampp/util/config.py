@@ -41,6 +41,13 @@ def hmi_b_products():
     """ Return the products for the HMI magnetogram. """
     return ['br', 'bp', 'bt']
 
+def available_cpu_count():
+    """ Return the number of CPUs this process may run on. """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
 # Set up the directories when this module is imported
 SAMPLE_DATA_DIR, DOWNLOAD_DIR, GXMODEL_DIR = setup_directories()
 AIA_EUV_PASSBANDS = aia_euv_passbands()
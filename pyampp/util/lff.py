@@ -22,6 +22,8 @@ class mf_lfff:
         pad_size = pad_size_half * 2
         field_pad = np.zeros(pad_size, dtype = np.float64, order = 'C')
         field_pad[:size[0], :size[1]] = field2D
+        # Pixels without data (e.g. off the reprojected map) are a zero boundary; cleaned on the padded copy in one pass
+        np.nan_to_num(field_pad, copy=False, nan=0.0)
         self.__field_av = np.mean(field_pad)
         field_pad -= self.__field_av
     
@@ -84,10 +86,11 @@ class mf_lfff:
                   , bz = bz[:self.__size[0], :self.__size[1]]
                    )
 
-    def lfff_cube(self, nz, alpha = 0, directive_cosines = (0, 0, 1)):
-        bx = np.zeros((self.__size[0], self.__size[1], nz))        
-        by = np.zeros((self.__size[0], self.__size[1], nz))        
-        bz = np.zeros((self.__size[0], self.__size[1], nz))        
+    def lfff_cube(self, nz, alpha = 0, directive_cosines = (0, 0, 1), dtype = np.float64):
+        # the layers are computed in double precision; dtype only sets the storage of the returned cubes
+        bx = np.zeros((self.__size[0], self.__size[1], nz), dtype = dtype)
+        by = np.zeros((self.__size[0], self.__size[1], nz), dtype = dtype)
+        bz = np.zeros((self.__size[0], self.__size[1], nz), dtype = dtype)
 
         for k in range(0, nz):
             res = self.lfff_at_z(k, alpha, directive_cosines)
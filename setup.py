@@ -62,7 +62,9 @@ setup(
         'numpy>=1.2',
         'ephem>=3.7.3.2',
         'scipy>=0.19',
-        'sunpy[all]>=5.0'
+        'sunpy[all]>=5.0',
+        'numba',
+        'h5py'
     ],
     extras_require={
         'dev': [